@@ -5,7 +5,7 @@ from firecrawl import FirecrawlApp
 from llm import LLMClient
 from pydantic import BaseModel, Field
 from typing import List, Dict, Optional
-from utils import write_to_file
+from utils import write_trace
 from utils import logger
 import json
 import os
@@ -64,7 +64,7 @@ class EventsAgent:
         self.llm_client = LLMClient()
 
     def trace(self, role: str, content: str) -> None:
-        write_to_file(path=self.output_trace_path, content=f"{role}: {content}\n")
+        write_trace(self.output_trace_path, f"{role}: {content}\n")
 
     def ask_llm(self, prompt: str) -> Optional[str]:
         self.trace("user", prompt)
@@ -5,7 +5,7 @@ from langchain_community.tools import DuckDuckGoSearchResults
 from llm import LLMClient
 from pydantic import BaseModel, Field
 from typing import List, Dict, Optional
-from utils import write_to_file
+from utils import RateLimiter, rate_limited, write_trace
 from utils import logger
 import json
 import os
@@ -45,7 +45,7 @@ class Message(BaseModel):
 
 
 class SearchAgent:
-    def __init__(self, output_trace_path: str):
+    def __init__(self, output_trace_path: str, rate_limiter: Optional[RateLimiter] = None):
         self.output_trace_path = output_trace_path
         self.search = DuckDuckGoSearchResults(output_format="json", max_results=10) # Reduced from 20
 
@@ -54,10 +54,11 @@ class SearchAgent:
             raise ValueError("FIRE_CRAWL_API key is required for SearchAgent.")
         
         self.firecrawl_app = FirecrawlApp(api_key=FIRE_CRAWL_API)
-        self.llm_client = LLMClient()
+        self.rate_limiter = rate_limiter
+        self.llm_client = LLMClient(rate_limiter=rate_limiter)
 
     def trace(self, role: str, content: str) -> None:
-        write_to_file(path=self.output_trace_path, content=f"{role}: {content}\n")
+        write_trace(self.output_trace_path, f"{role}: {content}\n")
 
     def ask_llm(self, prompt: str) -> Optional[str]:
         self.trace("user", prompt)
@@ -104,7 +105,9 @@ class SearchAgent:
         
         logger.info(f"SearchAgent: Executing search query for - {search_str}")
         try:
-            search_query_results_json = json.loads(self.search.invoke(search_str), strict=False)
+            with rate_limited(self.rate_limiter):
+                search_output = self.search.invoke(search_str)
+            search_query_results_json = json.loads(search_output, strict=False)
             search_query_results = [
                 SearchQueryResult(
                     title=item.get("title", ""),
@@ -163,11 +166,12 @@ class SearchAgent:
 
                 try:
                     logger.info(f"SearchAgent: Scraping the url - {search_result.link}")
-                    scrape_result = self.firecrawl_app.scrape_url(
-                        url=search_result.link,
-                        formats=["markdown"],
-                        only_main_content= True
-                    )
+                    with rate_limited(self.rate_limiter):
+                        scrape_result = self.firecrawl_app.scrape_url(
+                            url=search_result.link,
+                            formats=["markdown"],
+                            only_main_content= True
+                        )
                     search_result.scraped_content = scrape_result
                     logger.info(f"\n\n{scrape_result}\n\n")
                 except Exception as e:
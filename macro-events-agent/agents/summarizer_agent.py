@@ -4,7 +4,7 @@ from langchain_community.tools import DuckDuckGoSearchResults
 from llm import LLMClient
 from pydantic import BaseModel, Field
 from typing import List, Dict, Optional
-from utils import write_to_file
+from utils import RateLimiter, write_trace
 from utils import logger
 import json
 import os
@@ -49,16 +49,16 @@ class Message(BaseModel):
 
 
 class SummarizerAgent:
-    def __init__(self, output_trace_path: str):
+    def __init__(self, output_trace_path: str, rate_limiter: Optional[RateLimiter] = None):
         self.template = self.load_template()
         self.output_trace_path = output_trace_path
-        self.llm_client = LLMClient()
+        self.llm_client = LLMClient(rate_limiter=rate_limiter)
 
     def load_template(self) -> str:
         return PROMPT
 
     def trace(self, role: str, content: str) -> None:
-        write_to_file(path=self.output_trace_path, content=f"{role}: {content}\n")
+        write_trace(self.output_trace_path, f"{role}: {content}\n")
 
     def ask_llm(self, prompt: str) -> Optional[str]:
         self.trace("user", prompt)
@@ -1,7 +1,7 @@
 from dotenv import load_dotenv
 from openai import OpenAI
 from typing import List, Dict, Optional
-from utils import logger
+from utils import RateLimiter, logger, rate_limited
 import os
 
 load_dotenv()
@@ -14,7 +14,8 @@ class LLMClient:
         self,
         api_key: Optional[str] = None,
         model_name: Optional[str] = None,
-        base_url: Optional[str] = None
+        base_url: Optional[str] = None,
+        rate_limiter: Optional[RateLimiter] = None
     ):
         self.api_key = api_key if api_key is not None else os.getenv("OPENROUTER_API_KEY")
         if not self.api_key:
@@ -23,6 +24,8 @@ class LLMClient:
 
         self.model_name = model_name if model_name is not None else self.DEFAULT_MODEL
         self.base_url = base_url if base_url is not None else self.DEFAULT_BASE_URL
+        # Shared with other clients when calls are made from several threads, to cap the overall request rate
+        self.rate_limiter = rate_limiter
 
         try:
             self.client = OpenAI(
@@ -36,10 +39,11 @@ class LLMClient:
 
     def get_response(self, messages) -> Optional[str]:
         try:
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=messages
-            )
+            with rate_limited(self.rate_limiter):
+                response = self.client.chat.completions.create(
+                    model=self.model_name,
+                    messages=messages
+                )
             if response.choices and response.choices[0].message:
                 content = response.choices[0].message.content
                 logger.debug(f"Received response from {self.model_name}: {content}")
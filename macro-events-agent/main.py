@@ -4,8 +4,9 @@ from agents.search_agent import SearchAgent
 from agents.summarizer_agent import SummarizerAgent
 from state import GlobalState, Event, SearchQueryResult
 from calendar_tools import GoogleCalendar
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from utils import logger
+from utils import RateLimiter, buffered_trace, logger
 import pprint
 import sys
 
@@ -13,18 +14,12 @@ import sys
 OUTPUT_PATH = "output/output.txt"
 CALENDAR_API_TOKEN_PATH = "api_keys/calendarapi_token.json"
 CALENDAR_API_CREDENTIALS_PATH = "api_keys/calendarapi_credentials.json"
-
-def events_node(state: GlobalState) -> GlobalState:
-    result = events_agent.execute(state)
-    return result
-
-def search_node(state: GlobalState) -> GlobalState:
-    result = search_agent.execute(state)
-    return result
-
-def summarizer_node(state: GlobalState) -> GlobalState:
-    result = summarizer_agent.execute(state)
-    return result
+# Search + summarize for an event is bound by remote API latency, so events are processed concurrently.
+# Keep this within the OpenRouter/Firecrawl rate limits.
+MAX_EVENT_WORKERS = 8
+# Search, scrape and LLM requests from all workers share one limiter
+MAX_REQUESTS_PER_SECOND = 2
+MAX_CONCURRENT_REQUESTS = 4
 
 
 if __name__ == "__main__":
@@ -43,9 +38,10 @@ if __name__ == "__main__":
 
     logger.info("Initializing agents...")
     try:
+        rate_limiter = RateLimiter(MAX_REQUESTS_PER_SECOND, MAX_CONCURRENT_REQUESTS)
         events_agent = EventsAgent(OUTPUT_PATH)
-        search_agent = SearchAgent(OUTPUT_PATH)
-        summarizer_agent = SummarizerAgent(OUTPUT_PATH)
+        search_agent = SearchAgent(OUTPUT_PATH, rate_limiter=rate_limiter)
+        summarizer_agent = SummarizerAgent(OUTPUT_PATH, rate_limiter=rate_limiter)
         logger.info("Agents initialized successfully.")
     except Exception as e:
         logger.error(f"Failed to initialize agents: {e}", exc_info=True)
@@ -55,63 +51,60 @@ if __name__ == "__main__":
         result = events_agent.execute(state)
         return result
 
-    def search_node(state: GlobalState) -> GlobalState:
-        result = search_agent.execute(state)
-        return result
-
-    def summarizer_node(state: GlobalState) -> GlobalState:
-        result = summarizer_agent.execute(state)
-        return result
-
     # --- Build Graph ---
     logger.info("Building LangGraph state machine...")
     builder = StateGraph(GlobalState)
     builder.add_node("events_agent", events_node)
-    builder.add_node("search_agent", search_node)
-    builder.add_node("summarizer_agent", summarizer_node)
 
-    def should_continue_node(state: GlobalState) -> GlobalState:
-        logger.info(f"should_continue_node: current_event_index: {state.current_event_index}, upcoming_events_count: {len(state.upcoming_events)}")
-        if state.upcoming_events and state.current_event_index < len(state.upcoming_events):
-            state.current_event = state.upcoming_events[state.current_event_index]
-
-            logger.info(f"should_continue_node: Selecting event '{state.current_event.name}' (index {state.current_event_index}) for processing.")
-            state.current_event_index += 1
-        else:
-            logger.info("should_continue_node: All events processed or no more events to process.")
-            state.current_event = None # Clear current_event when no more upcomingevents
+    def process_event(event: Event) -> Event:
+        # Each event gets its own state so search/summarize can run independently of the others.
+        # The event's trace is written in one piece when it finishes, so concurrent events do not interleave.
+        event_state = GlobalState(upcoming_events=[event], current_event=event, current_event_index=0)
+        with buffered_trace():
+            search_agent.execute(event_state)
+            summarizer_agent.execute(event_state)
+        return event
+
+    def process_events_node(state: GlobalState) -> GlobalState:
+        if not state.upcoming_events:
+            logger.info("process_events_node: No upcoming events to process.")
+            return state
+
+        num_workers = min(MAX_EVENT_WORKERS, len(state.upcoming_events))
+        logger.info(f"process_events_node: Processing {len(state.upcoming_events)} events with {num_workers} workers.")
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            futures = [pool.submit(process_event, event) for event in state.upcoming_events]
+            for event, future in zip(state.upcoming_events, futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"process_events_node: Failed to process event '{event.name}': {e}", exc_info=True)
 
         return state
-    builder.add_node("should_continue", should_continue_node)
-
-    def create_calendar_event_node(state: GlobalState) -> GlobalState:
-        logger.info(f"create_calendar_event_node: current_event name '{state.current_event.name}'")
-        # TODO: Handle errors here
-        new_event = calendar_service.create_event(
-            state.current_event.name,
-            state.current_event.summary if state.current_event.summary is not None else "Meeting prep not available for this event.",
-            state.current_event.date,
-            add_7_am_notifications=True
-        )
-        # logger.info(f"create_calendar_event_node: Successfully created calendar event for: {new_event.get("name")}")
-        pprint.pprint(new_event)
+    builder.add_node("process_events", process_events_node)
+
+    def create_calendar_events_node(state: GlobalState) -> GlobalState:
+        for event in state.upcoming_events:
+            logger.info(f"create_calendar_events_node: Creating calendar event for '{event.name}'")
+            # A failed insert is logged and skipped so the remaining events are still created
+            try:
+                new_event = calendar_service.create_event(
+                    event.name,
+                    event.summary if event.summary is not None else "Meeting prep not available for this event.",
+                    event.date,
+                    add_7_am_notifications=True
+                )
+                pprint.pprint(new_event)
+            except Exception as e:
+                logger.error(f"create_calendar_events_node: Failed to create calendar event for '{event.name}': {e}", exc_info=True)
 
         return state
-    builder.add_node("create_calendar_event", create_calendar_event_node)
+    builder.add_node("create_calendar_events", create_calendar_events_node)
 
     builder.set_entry_point("events_agent")
-    builder.add_edge("events_agent", "should_continue")
-    builder.add_conditional_edges(
-        source="should_continue",
-        path=lambda x: "continue" if x.upcoming_events and x.current_event is not None else "end",
-        path_map={
-            "continue": "search_agent",
-            "end": END
-        }
-    )
-    builder.add_edge("search_agent", "summarizer_agent")
-    builder.add_edge("summarizer_agent", "create_calendar_event")
-    builder.add_edge("create_calendar_event", "should_continue")
+    builder.add_edge("events_agent", "process_events")
+    builder.add_edge("process_events", "create_calendar_events")
+    builder.add_edge("create_calendar_events", END)
 
     graph = builder.compile()
     logger.info("LangGraph state machine built successfully.")
@@ -1,5 +1,8 @@
+from contextlib import contextmanager, nullcontext
 from typing import Optional
 import logging
+import threading
+import time
 
 logging.basicConfig(
     level=logging.INFO,  # or DEBUG
@@ -31,3 +34,74 @@ def write_to_file(path: str, content: str) -> None:
     except Exception as e:
         logger.error(f"Error writing to file '{path}': {e}")
         raise
+
+
+# Trace output collected per thread by buffered_trace(), keyed by path
+_trace_buffer = threading.local()
+_trace_write_lock = threading.Lock()
+
+
+def write_trace(path: str, content: str) -> None:
+    parts = getattr(_trace_buffer, "parts", None)
+    if parts is None:
+        write_to_file(path, content)
+    else:
+        parts.setdefault(path, []).append(content)
+
+
+@contextmanager
+def buffered_trace():
+    # Trace writes made on this thread inside the block are written together when it exits,
+    # so traces of events processed concurrently do not interleave in the trace file
+    _trace_buffer.parts = {}
+    try:
+        yield
+    finally:
+        parts, _trace_buffer.parts = _trace_buffer.parts, None
+        with _trace_write_lock:
+            for path, contents in parts.items():
+                write_to_file(path, "".join(contents))
+
+
+class TokenBucket:
+    """Thread-safe token bucket: allows bursts of up to capacity calls, refilled at rate tokens per second."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """Caps requests shared across threads: at most max_concurrent in flight, started at most rate per second."""
+
+    def __init__(self, rate: float, max_concurrent: int):
+        self.semaphore = threading.BoundedSemaphore(max_concurrent)
+        self.bucket = TokenBucket(rate, max_concurrent)
+
+    def __enter__(self) -> "RateLimiter":
+        self.semaphore.acquire()
+        self.bucket.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.semaphore.release()
+
+
+def rate_limited(rate_limiter: Optional[RateLimiter]):
+    # Context manager for a single request; a no-op when no limiter is shared
+    return rate_limiter if rate_limiter is not None else nullcontext()
@@ -1,28 +1,26 @@
-from llm import LLMClient
-from pydantic import BaseModel, Field
-from state import GlobalState
+from concurrent.futures import ThreadPoolExecutor
+from llm import LLMClient, ResponseCache
+from state import GlobalState, Message
+from string import Formatter
 from tools import Tool
-from typing import Callable, Dict, List, Optional
-from utils import logger, write_to_file
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, TextIO, Tuple
+from utils import extract_json, logger
 import json
+import numpy as np
 import tools as t
 
 
-PROMPT = """
+# Static instructions plus the game details form the system prompt. It stays identical across iterations,
+# so providers can serve it from their prompt cache; only the short user prompt changes per iteration.
+SYSTEM_PROMPT = """
 You are an NBA Sportsbook agent designed to provide betting-relevant insights.
 
-User Query: {query}
-
-Your goal is to answer the query by synthesizing information from the game details, player statistics, betting odds, and any previous reasoning steps.
+Your goal is to answer the user's query by synthesizing information from the game details, player statistics, betting odds, and any previous reasoning steps.
 You must reason carefully over this data to produce high-confidence, insight-driven answers that could support betting decisions (e.g., identifying player markets with high value, team trends, or same-game parlays).
 
 You do not have access to tools. You must rely entirely on the information provided below
 and your analytical capabilities.
 
-{game_details}
-
-{history}
-
 Instructions:
 1.  Analyze the user query to understand the specific information or insight requested.
 2.  Review the provided game details, player stats, and betting odds.
@@ -34,51 +32,68 @@ JSON Response Format:
 
 If you are still processing information or need to perform further analysis (this typically means another iteration if you were designed for multi-step thinking, but here you should aim for a single, well-reasoned answer if possible):
 {{
-    "thought": "Detailed reasoning about what the query requires, what data you are analyzing, key observations, and how you are connecting them to address the query. Explain your thought process clearly."
+    "t": "Detailed reasoning about what the query requires, what data you are analyzing, key observations, and how you are connecting them to address the query. Explain your thought process clearly."
 }}
 
 If you have enough information to answer the query:
 {{
-    "thought": "Your final reasoning process, summarizing how you arrived at the answer based on the available data and the query.",
-    "answer": "Your comprehensive answer to the query. This should directly address the user's request with specific insights, numbers, and justifications derived from the data."
+    "t": "Your final reasoning process, summarizing how you arrived at the answer based on the available data and the query.",
+    "a": "Your comprehensive answer to the query. This should directly address the user's request with specific insights, numbers, and justifications derived from the data."
 }}
 
 Guidelines:
--   Be thorough in your reasoning. Clearly explain how the data supports your conclusions.
+-   Be precise in your reasoning. Clearly explain how the data supports your conclusions.
 -   Always base your reasoning on the actual observations and provided data. Do not invent information.
 -   Prioritize insights that directly assist betting decisions (e.g., team trends, player performance against certain opponents, consistency in hitting specific stat lines, value in odds).
 -   Account for factors like minutes played when analyzing player stats.
 -   Give higher importance to recent player performance (e.g., last 5-10 games) if such trends are evident in the data.
 -   Be transparent if the provided data is insufficient or inconclusive for a specific part of the query. State what's missing.
 -   Do not guess. Rely only on verifiable data or explicitly acknowledge uncertainty.
--   Provide a final answer ("answer" field) only when you are confident you have synthesized the available information to address the query as best as possible.
+-   Keep "t" brief: a few sentences covering only the key observations behind the answer.
+-   Provide a final answer ("a" field) only when you are confident you have synthesized the available information to address the query as best as possible.
 -   If the data is not sufficient to fully answer the query, provide the best possible answer with the available data and clearly state what additional data or context would be required for a more complete response.
+
+{game_details}
+"""
+
+USER_PROMPT = """
+User Query: {query}
+
+{history}
 """
 
+# Only the most recent games are summarized; older games add prompt tokens but little signal
+RECENT_GAMES_LIMIT = 10
 
-def decimal_to_american_odds(decimal_odds):
-    if decimal_odds < 1.01:
-        raise ValueError("Decimal odds must be at least 1.01")
-    
-    # Convert to American
-    if decimal_odds >= 2.0:
-        american = int((decimal_odds - 1) * 100)
-        american_str = f"+{american}"
-    else:
-        american = int(-100 / (decimal_odds - 1))
-        american_str = f"{american}"
-    
-    return american_str
+# Upper bound on threads used to build player stats summaries
+MAX_SUMMARY_WORKERS = 8
 
 
-class Message(BaseModel):
-    role: str = Field(..., description="The role of the message sender (e.g., 'user', 'assistant').")
-    content: str = Field(..., description="The content of the message.")
+def decimal_to_american_odds_array(decimal_odds: np.ndarray) -> np.ndarray:
+    # Converts decimal odds to American odds strings ("+150", "-200"), truncating toward zero.
+    # Expects all odds to be at least 1.01; callers filter out smaller prices.
+    is_plus = decimal_odds >= 2.0
+    american = np.where(is_plus, (decimal_odds - 1) * 100, -100 / (decimal_odds - 1)).astype(int)
+    return np.char.add(np.where(is_plus, "+", ""), american.astype(str))
+
+
+def split_template(template: str) -> List[Tuple[str, Optional[str]]]:
+    # Parse the template once into (literal, field_name) pairs; escaped braces are already unescaped.
+    return [(literal, field_name) for literal, field_name, _, _ in Formatter().parse(template)]
+
+
+def render_template(template_parts: List[Tuple[str, Optional[str]]], values: Dict[str, str]) -> str:
+    parts = []
+    for literal, field_name in template_parts:
+        parts.append(literal)
+        if field_name is not None:
+            parts.append(values[field_name])
+    return "".join(parts)
 
 
 class AnalysisAgent:
 
-    def __init__(self, output_trace_path: str):
+    def __init__(self, trace_file: TextIO, response_cache_path: Optional[str] = None, llm_client: Optional[LLMClient] = None):
         self.messages: List[Message] = []
         self.query = ""
 
@@ -86,17 +101,29 @@ class AnalysisAgent:
         self.max_iterations = 2
         self.current_iteration = 0
 
-        self.template = self.load_template()
+        system_template, user_template = self.load_template()
+        self.system_template_parts = split_template(system_template)
+        self.user_template_parts = split_template(user_template)
+
+        self.trace_file = trace_file
+
+        # Player stats summaries keyed by (nba_player_id, number of games)
+        self.stats_summary_cache: Dict[Tuple[str, int], str] = {}
+
+        self.bets_block = ""
 
-        self.output_trace_path = output_trace_path
+        self.llm_client = llm_client if llm_client is not None else LLMClient()
 
-        self.llm_client = LLMClient()
+        # Responses that produced a final answer are cached, so re-running the same prompt is free
+        self.response_cache = ResponseCache(response_cache_path) if response_cache_path else None
+        self.pending_cache_key: Optional[str] = None
 
-    def load_template(self) -> str:
-        return PROMPT
+    def load_template(self) -> Tuple[str, str]:
+        return SYSTEM_PROMPT, USER_PROMPT
 
     def construct_player_stats_summary(self, player_stats) -> str:
-        recent_games = player_stats
+        # Stats are sorted by game date descending, so the head holds the most recent games
+        recent_games = player_stats.head(RECENT_GAMES_LIMIT)
         total_games = len(recent_games)
 
         # Columns to include in averages
@@ -108,14 +135,14 @@ class AnalysisAgent:
             'TOV', 'PF', 'PLUS_MINUS'
         ]
 
-        # Ensure columns are numeric
-        recent_games[stat_cols] = recent_games[stat_cols].astype(float)
+        # Ensure columns are numeric (on a copy, the caller's frame is left untouched)
+        values = recent_games[stat_cols].to_numpy(dtype=np.float64)
 
-        # Calculate averages
-        avg_stats = recent_games[stat_cols].mean()
+        # Calculate averages (NaN-skipping, like DataFrame.mean)
+        avg_stats = dict(zip(stat_cols, np.nanmean(values, axis=0)))
 
         # Build average summary
-        summary = (
+        parts = [
             f"        *Averages over last {total_games} games this season:*\n"
             f"        - MIN: {avg_stats['MIN']:.1f}, PTS: {avg_stats['PTS']:.1f}, REB: {avg_stats['REB']:.1f}, "
             f"AST: {avg_stats['AST']:.1f}, STL: {avg_stats['STL']:.1f}, BLK: {avg_stats['BLK']:.1f}\n"
@@ -123,135 +150,190 @@ class AnalysisAgent:
             f"3P: {avg_stats['FG3M']:.1f}/{avg_stats['FG3A']:.1f} ({avg_stats['FG3_PCT']*100:.1f}%), "
             f"FT: {avg_stats['FTM']:.1f}/{avg_stats['FTA']:.1f} ({avg_stats['FT_PCT']*100:.1f}%)\n"
             f"        - TOV: {avg_stats['TOV']:.1f}, PF: {avg_stats['PF']:.1f}, +/-: {avg_stats['PLUS_MINUS']:.1f}\n\n"
-        )
+        ]
+
+        # Format every stat column in one vectorized pass instead of per-row f-strings
+        fmt = {col: np.char.mod('%.1f', values[:, i]) for i, col in enumerate(stat_cols)}
+        for col in ('FG_PCT', 'FG3_PCT', 'FT_PCT'):
+            fmt[col] = np.char.mod('%.1f', values[:, stat_cols.index(col)] * 100)
 
         # Game-by-game stats
-        summary += "        *Game-by-game stats this season:*\n"
-        for _, row in recent_games.iterrows():
-            summary += (
-                f"        - {row['GAME_DATE']} vs {row['MATCHUP']}: "
-                f"{row['PTS']} pts, {row['REB']} reb, {row['AST']} ast, "
-                f"{row['STL']} stl, {row['BLK']} blk, "
-                f"FG {row['FGM']}/{row['FGA']} ({row['FG_PCT']*100:.1f}%), "
-                f"3P {row['FG3M']}/{row['FG3A']} ({row['FG3_PCT']*100:.1f}%), "
-                f"FT {row['FTM']}/{row['FTA']} ({row['FT_PCT']*100:.1f}%), "
-                f"{row['TOV']} TO, {row['PF']} PF, {row['PLUS_MINUS']} +/- in {row['MIN']} mins\n"
+        parts.append(f"        *Game-by-game stats over last {total_games} games this season:*\n")
+        for i, (game_date, matchup) in enumerate(zip(recent_games['GAME_DATE'], recent_games['MATCHUP'])):
+            parts.append(
+                f"        - {game_date} vs {matchup}: "
+                f"{fmt['PTS'][i]} pts, {fmt['REB'][i]} reb, {fmt['AST'][i]} ast, "
+                f"{fmt['STL'][i]} stl, {fmt['BLK'][i]} blk, "
+                f"FG {fmt['FGM'][i]}/{fmt['FGA'][i]} ({fmt['FG_PCT'][i]}%), "
+                f"3P {fmt['FG3M'][i]}/{fmt['FG3A'][i]} ({fmt['FG3_PCT'][i]}%), "
+                f"FT {fmt['FTM'][i]}/{fmt['FTA'][i]} ({fmt['FT_PCT'][i]}%), "
+                f"{fmt['TOV'][i]} TO, {fmt['PF'][i]} PF, {fmt['PLUS_MINUS'][i]} +/- in {fmt['MIN'][i]} mins\n"
             )
 
-        return summary
+        return "".join(parts)
+
 
+    def get_player_stats_summaries(self, players_stats: Dict[str, Any]) -> Dict[str, str]:
+        cache_keys = {player_id: (player_id, len(player_stats)) for player_id, player_stats in players_stats.items()}
+        missing = [player_id for player_id, cache_key in cache_keys.items() if cache_key not in self.stats_summary_cache]
 
-    def construct_game_details(self, state: GlobalState) -> str:
-        game_details = ""
-        game_details += """
+        # Summaries are independent pandas work per player, so build the missing ones concurrently
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(MAX_SUMMARY_WORKERS, len(missing))) as executor:
+                summaries = executor.map(self.construct_player_stats_summary, [players_stats[player_id] for player_id in missing])
+                for player_id, summary in zip(missing, summaries):
+                    self.stats_summary_cache[cache_keys[player_id]] = summary
+
+        return {player_id: self.stats_summary_cache[cache_key] for player_id, cache_key in cache_keys.items()}
+
+    def get_players_with_stats(self, state: GlobalState) -> List[Any]:
+        if state.game_details is None:
+            return []
+        return [
+            player_info for player_info in state.game_details.players_info
+            if player_info.nba_player_id in state.player_stats
+        ]
+
+    def format_bets_block(self, state: GlobalState, player_names_with_stats: Set[str]) -> str:
+        if state.game_details is None or not len(state.upcoming_bets):
+            return ""
+
+        parts = ["""
+---
+## Betting Odds:
+"""]
+        upcoming_bets = state.upcoming_bets.get(state.game_details.game_info.odds_game_id)
+        if upcoming_bets is not None:
+            for odds_player_name in upcoming_bets.get_all_player_names():
+                if odds_player_name in player_names_with_stats:
+                    player_bets = upcoming_bets.get_player_market(odds_player_name)
+                    parts.append(f"    - Player Name: {odds_player_name}\n")
+
+                    for bet_market, bets in player_bets.items():
+                        parts.append(f"        - {bet_market.upper()}\n")
+                        valid_bets = [bet for bet in bets if bet.price >= 1.01]
+                        if not valid_bets:
+                            continue
+                        american_odds = decimal_to_american_odds_array(np.array([bet.price for bet in valid_bets], dtype=float))
+                        for bet, odds in zip(valid_bets, american_odds):
+                            parts.append(f"            - {bet.name} {bet.point} {odds}\n")
+
+        return "".join(parts)
+
+    def construct_game_details(self, state: GlobalState, players_with_stats: List[Any]) -> str:
+        parts = ["""
 ---
-## Game Info:"""
+## Game Info:"""]
         if state.game_details is not None:
-            odds_game_id = state.game_details.game_info.odds_game_id
-
-            game_details += f"""
+            parts.append(f"""
     - Home Team: {state.game_details.home_team_info.odds_team_name}
     - Away Team: {state.game_details.away_team_info.odds_team_name}
-"""
-            player_names_with_stats = []
+""")
             if len(state.game_details.players_info):
-                game_details += f"""
+                parts.append("""
 ## Recent Player Stats:
-"""
-                for player_info in state.game_details.players_info:
-                    player_name = player_info.odds_player_name
-                    player_id = player_info.nba_player_id
-
-                    if player_id in state.player_stats:
-                        player_names_with_stats.append(player_name)
-                        player_stats = state.player_stats.get(player_id)
-                        game_details += f"    - Player Name: {player_name}\n"
-                        game_details += f"{self.construct_player_stats_summary(player_stats)}\n"
-
-            if len(state.upcoming_bets):
-                game_details += """
----
-## Betting Odds:
-"""
-
-                if odds_game_id in state.upcoming_bets:
-                    upcoming_bets = state.upcoming_bets.get(odds_game_id)
-                    all_players = upcoming_bets.get_all_player_names()
-                    for odds_player_name in all_players:
-                        if odds_player_name in player_names_with_stats:
-                            player_bets = upcoming_bets.get_player_market(odds_player_name)
-                            game_details += f"    - Player Name: {odds_player_name}\n"
-
-                            for bet_market, bets in player_bets.items():
-                                game_details += f"        - {bet_market.upper()}\n"
-                                for bet in bets:
-                                    if bet.price >= 1.01:
-                                        game_details += f"            - {bet.name}" + " " + f"{bet.point}" + " " + f"{decimal_to_american_odds(bet.price)}" + "\n"
-
-        return game_details
-
-    def ask_llm(self, prompt: str) -> str:
-        contents = [Message(role='user', content=prompt)]
-        response = self.llm_client.get_response(contents)
-
-        return str(response) if response is not None else "No response from LLM"
+""")
+                summaries = self.get_player_stats_summaries({
+                    player_info.nba_player_id: state.player_stats[player_info.nba_player_id]
+                    for player_info in players_with_stats
+                })
+                for player_info in players_with_stats:
+                    parts.append(f"    - Player Name: {player_info.odds_player_name}\n")
+                    parts.append(f"{summaries[player_info.nba_player_id]}\n")
+
+            parts.append(self.bets_block)
+
+        return "".join(parts)
+
+    def ask_llm(self, system_prompt: str, user_prompt: str) -> Iterator[str]:
+        contents = [Message(role='system', content=system_prompt), Message(role='user', content=user_prompt)]
+
+        self.pending_cache_key = None
+        if self.response_cache is not None:
+            cache_key = ResponseCache.make_key(self.llm_client.model_name, contents)
+            cached_response = self.response_cache.get(cache_key)
+            if cached_response is not None:
+                logger.info("Using cached LLM response.")
+                yield cached_response
+                return
+            self.pending_cache_key = cache_key
+
+        # Only the JSON object is needed, so the stream is cut off once it closes
+        yield from self.llm_client.stream_response(contents, cache_system_prompt=True, stop_after_json=True)
 
     def execute(self, state: GlobalState) -> GlobalState:
         self.query = state.user_query
-        self.game_details = self.construct_game_details(state)
+        # Players and the bets block are resolved once per run; the prompt only concatenates them
+        players_with_stats = self.get_players_with_stats(state)
+        self.bets_block = self.format_bets_block(state, {player_info.odds_player_name for player_info in players_with_stats})
+        self.game_details = self.construct_game_details(state, players_with_stats)
+        self.system_prompt = render_template(self.system_template_parts, {"game_details": self.game_details})
+
+        try:
+            # The query is already part of every prompt, so it is written to the trace but kept out of the history
+            self.trace_file.write(f"user: {self.query}\n")
+
+            self.think(state)
+        finally:
+            self.trace_file.flush()
 
-        self.trace(role="user", content=self.query)
-        
-        self.think(state)
-        
         return state
 
     def think(self, state: GlobalState) -> None:
-        self.current_iteration += 1
+        while self.current_iteration < self.max_iterations:
+            self.current_iteration += 1
 
-        logger.info(f"Starting iteration {self.current_iteration}")
-        write_to_file(path=self.output_trace_path, content=f"\n{'='*50}\nIteration {self.current_iteration}\n{'='*50}\n")
+            logger.info(f"Starting iteration {self.current_iteration}")
+            self.trace_file.write(f"\n{'='*50}\nIteration {self.current_iteration}\n{'='*50}\n")
 
-        if self.current_iteration > self.max_iterations:
-            logger.warning("Reached maximum iterations. Stopping.")
-            return
+            user_prompt = render_template(self.user_template_parts, {
+                "query": self.query,
+                "history": self.get_history()
+            })
 
-        prompt = self.template.format(
-            query=self.query,
-            history=self.get_history(),
-            game_details=self.game_details
-        )
+            try:
+                response = self.stream_trace("assistant", "Thought: ", self.ask_llm(self.system_prompt, user_prompt))
+            except Exception as e:
+                # The partial response is already in the trace; it is never parsed or cached
+                retry_note = " Let me try again." if self.current_iteration < self.max_iterations else ""
+                self.trace("assistant", f"The response was cut off. Error: {str(e)}.{retry_note}")
+                continue
+            logger.info(f"Thinking => {response}")
 
-        response = self.ask_llm(prompt)
-        logger.info(f"Thinking => {response}")
-        self.trace("assistant", f"Thought: {response}")
-        
-        self.decide(response, state)
+            if self.decide(response, state):
+                return
 
-    def decide(self, response: str, state: GlobalState) -> None:
+        logger.warning("Reached maximum iterations. Stopping.")
+
+    def decide(self, response: str, state: GlobalState) -> bool:
+        # Returns True once a final answer is stored on the state, False if another iteration is needed
         try:
-            cleaned_response = response.strip().strip('`').strip()
-            if cleaned_response.startswith('json'):
-                cleaned_response = cleaned_response[4:].strip()
-            
-            parsed_response = json.loads(cleaned_response, strict=False)
+            parsed_response = extract_json(response)
 
-            if "answer" in parsed_response:
-                self.trace("assistant", f"Final Answer: {parsed_response['answer']}")
+            if "a" in parsed_response:
+                self.trace("assistant", f"Final Answer: {parsed_response['a']}")
 
-                state.final_answer = parsed_response['answer']
+                state.final_answer = parsed_response['a']
+                self.cache_response(response)
+                return True
             else:
                 raise ValueError("Invalid response format")
         except json.JSONDecodeError as e:
             logger.error(f"Failed to parse response: {response}. Error: {str(e)}")
-            self.trace("assistant", f"I encountered an error in processing. Error: {str(e)}. Let me try again.")
-
-            self.think(state)
+            retry_note = " Let me try again." if self.current_iteration < self.max_iterations else ""
+            self.trace("assistant", f"I encountered an error in processing. Error: {str(e)}.{retry_note}")
         except Exception as e:
             logger.error(f"Error processing response: {str(e)}")
-            self.trace("assistant", f"I encountered an unexpected error. Error: {str(e)}. Let me try a different approach.")
+            retry_note = " Let me try a different approach." if self.current_iteration < self.max_iterations else ""
+            self.trace("assistant", f"I encountered an unexpected error. Error: {str(e)}.{retry_note}")
 
-            self.think(state)
+        return False
+
+    def cache_response(self, response: str) -> None:
+        # Only responses that parsed into an answer are stored; a retry never replays a bad response
+        if self.response_cache is not None and self.pending_cache_key is not None:
+            self.response_cache.set(self.pending_cache_key, response)
+            self.pending_cache_key = None
 
     def get_history(self) -> str:
         if len(self.messages) > 0:
@@ -259,4 +341,26 @@ class AnalysisAgent:
         return ""
 
     def trace(self, role: str, content: str) -> None:
-        write_to_file(path=self.output_trace_path, content=f"{role}: {content}\n")
+        # Traced turns are also the history shown to the model on the next iteration
+        self.messages.append(Message(role=role, content=content))
+        self.trace_file.write(f"{role}: {content}\n")
+
+    def stream_trace(self, role: str, prefix: str, chunks: Iterable[str]) -> str:
+        # Streamed text is flushed chunk by chunk, so the trace shows it as it arrives
+        received = []
+        self.trace_file.write(f"{role}: {prefix}")
+        try:
+            for chunk in chunks:
+                received.append(chunk)
+                self.trace_file.write(chunk)
+                self.trace_file.flush()
+        except Exception:
+            self.trace_file.write("\n")
+            raise
+        response = "".join(received)
+        if not response:
+            response = "No response from LLM"
+            self.trace_file.write(response)
+        self.trace_file.write("\n")
+        self.messages.append(Message(role=role, content=prefix + response))
+        return response
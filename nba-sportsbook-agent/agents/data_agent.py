@@ -1,27 +1,22 @@
+from enum import Enum
 from llm import LLMClient
-from pydantic import BaseModel, Field
-from state import GlobalState
+from state import GlobalState, Message
 from tools import Tool
-from typing import Callable, Dict, List, Optional
-from utils import logger, write_to_file
+from typing import Callable, Dict, List, Optional, TextIO, Tuple
+from utils import loads_json, logger, strip_code_fence
 import json
 import tools as t
 
 
-PROMPT = """
+# The static head (instructions + tool descriptions) is formatted once per agent; only the short
+# dynamic tail with the query, state and history is formatted each iteration and appended at the end.
+STATIC_PROMPT_HEAD = """
 You are a Data Agent in a multi-agent NBA sportsbook system.
 
 Your role is to examine the user's query and determine what data is required to fulfill it.
 You have access to a shared state that may already contain some data.
 Your task is to identify any missing data and use the appropriate tools to load only the missing parts.
 
-Query: {query}
-
-Current known data in memory (state): {current_state}
-
-Previous reasoning steps and observations (if any, this is your scratchpad):
-{history}
-
 Available tools:
 {tools}
 
@@ -64,27 +59,41 @@ Guidelines:
   Use the history to understand previous attempts and avoid repeating mistakes.
 """
 
+DYNAMIC_PROMPT = """
+Query: {query}
+
+Current known data in memory (state): {current_state}
+
+Previous reasoning steps and observations (if any, this is your scratchpad):
+{history}
+"""
 
-class Message(BaseModel):
-    role: str = Field(..., description="The role of the message sender (e.g., 'user', 'assistant').")
-    content: str = Field(..., description="The content of the message.")
+
+class Step(Enum):
+    ACTION = "action"
+    ANSWER = "answer"
+    RETRY = "retry"
 
 
 class DataAgent:
 
-    def __init__(self, output_trace_path: str, max_iterations: int = 5):
+    def __init__(self, trace_file: TextIO, max_iterations: int = 5, llm_client: Optional[LLMClient] = None):
         self.tools: Dict[str, Tool]
         self.messages: List[Message] = []
+        # Rendered history lines are kept alongside messages, so get_history only joins when something changed
+        self.history_parts: List[str] = []
+        self.history_cache: Optional[str] = None
         self.query = ""
 
         self.max_iterations = max_iterations
         self.current_iteration = 0
-        self.output_trace_path = output_trace_path
-        self.llm_client = LLMClient()
+        self.trace_file = trace_file
+        self.llm_client = llm_client if llm_client is not None else LLMClient()
 
         self.load_tools()
-        self.template = self.load_template()
+        static_template, self.dynamic_template = self.load_template()
         self.tool_descriptions = self.load_tool_descriptions()
+        self.static_prefix = static_template.format(tools=self.tool_descriptions)
 
         logger.info(f"DataAgent initialized with max_iterations: {self.max_iterations}")
 
@@ -108,48 +117,50 @@ class DataAgent:
 
         logger.info(f"DataAgent tools loaded: {', '.join(self.tools.keys())}")
 
-    def load_template(self) -> str:
-        return PROMPT
+    def load_template(self) -> Tuple[str, str]:
+        return STATIC_PROMPT_HEAD, DYNAMIC_PROMPT
 
     def load_tool_descriptions(self) -> str:
         return "\n".join([tool.describe() for tool in self.tools.values()])
 
-    def ask_llm(self, prompt: str) -> str:
-        contents = [Message(role='user', content=prompt)]
-        response = self.llm_client.get_response(contents)
+    def ask_llm(self, system_prompt: str, user_prompt: str) -> str:
+        # The static prefix goes in a system message marked as a prompt cache breakpoint
+        contents = [Message(role='system', content=system_prompt), Message(role='user', content=user_prompt)]
+        response = self.llm_client.get_response(contents, cache_system_prompt=True, stop_after_json=True)
 
         return str(response) if response is not None else "No response from LLM"
 
     def think(self, state: GlobalState) -> None:
-        self.current_iteration += 1
+        while self.current_iteration < self.max_iterations:
+            self.current_iteration += 1
+
+            logger.info(f"Starting iteration {self.current_iteration}")
+            self.trace_file.write(f"\n{'='*50}\nIteration {self.current_iteration}\n{'='*50}\n")
 
-        logger.info(f"Starting iteration {self.current_iteration}")
-        write_to_file(path=self.output_trace_path, content=f"\n{'='*50}\nIteration {self.current_iteration}\n{'='*50}\n")
+            user_prompt = self.dynamic_template.format_map({
+                "query": self.query,
+                "current_state": state.summarize_state_for_data_agent(),
+                "history": self.get_history()
+            })
 
-        if self.current_iteration > self.max_iterations:
-            logger.warning("Reached maximum iterations. Stopping.")
-            return
+            response = self.ask_llm(self.static_prefix, user_prompt)
+            logger.info(f"Thinking => {response}")
+            self.trace("assistant", f"Thought: {response}")
 
-        prompt = self.template.format(
-            query=self.query,
-            current_state=state.summarize_state_for_data_agent(),
-            history=self.get_history(),
-            tools=self.tool_descriptions
-        )
+            step, tool_name, action_input = self.decide(response, state)
+            if step is Step.ANSWER:
+                return
+            if step is Step.ACTION:
+                self.act(tool_name, action_input, state)
 
-        response = self.ask_llm(prompt)
-        logger.info(f"Thinking => {response}")
-        self.trace("assistant", f"Thought: {response}")
-        
-        self.decide(response, state)
+        logger.warning("Reached maximum iterations. Stopping.")
 
-    def decide(self, response: str, state: GlobalState) -> None:
+    def decide(self, response: str, state: GlobalState) -> Tuple[Step, Optional[str], Optional[Dict]]:
+        # Returns the next step along with the tool name and input when the step is an action
         try:
-            cleaned_response = response.strip().strip('`').strip()
-            if cleaned_response.startswith('json'):
-                cleaned_response = cleaned_response[4:].strip()
+            cleaned_response = strip_code_fence(response)
             
-            parsed_response = json.loads(cleaned_response, strict=False)
+            parsed_response = loads_json(cleaned_response)
             
             if "action" in parsed_response:
                 action = parsed_response["action"]
@@ -157,28 +168,24 @@ class DataAgent:
                 self.trace("assistant", f"Action: Using {tool_name} tool")
 
                 action_input = action.get("input", None)
-                if (action_input is None or action_input == {}):
-                    self.act(tool_name, None, state)
-                else:
-                    self.act(tool_name, action_input, state)
+                return Step.ACTION, tool_name, action_input if action_input else None
             elif "answer" in parsed_response:
                 self.trace("assistant", f"Final Answer: {parsed_response['answer']}")
 
                 state.required_data_loaded = True
+                return Step.ANSWER, None, None
             else:
                 raise ValueError("Invalid response format")
         except json.JSONDecodeError as e:
             logger.error(f"Failed to parse response: {response}. Error: {str(e)}")
             self.trace("assistant", f"I encountered an error in processing. Error: {str(e)}. Let me try again.")
-
-            self.think(state)
         except Exception as e:
             logger.error(f"Error processing response: {str(e)}")
             self.trace("assistant", f"I encountered an unexpected error. Error: {str(e)}. Let me try a different approach.")
 
-            self.think(state)
+        return Step.RETRY, None, None
 
-    def act(self, tool_name: str, query: Dict, state: GlobalState) -> None:
+    def act(self, tool_name: str, query: Optional[Dict], state: GlobalState) -> None:
         tool = self.tools.get(tool_name)
         if tool:
             result = tool.use(query)
@@ -186,38 +193,43 @@ class DataAgent:
             if tool_name == "LOAD_UPCOMING_NBA_GAMES_AND_BETS" and isinstance(result, tuple):
                 state.upcoming_games = result[0]
                 state.upcoming_bets = result[1]
+                state.invalidate_summary()
                 result = "Successfully loaded upcoming NBA games along with the bets into state."
             elif tool_name == "LOAD_PLAYERS_STATS" and isinstance(result, dict):
-                for key, df in result.items():
-                    state.player_stats[key] = df
-                result = "Successfully loaded player stats for " + ",".join(result.keys())
+                loaded_player_ids = ",".join(result)
+                state.player_stats.update(result)
+                state.invalidate_summary()
+                result = f"Successfully loaded player stats for {loaded_player_ids}"
             
             observation = f"Observation from {tool_name}: {result}"
             self.trace("system", observation)
-            self.messages.append(Message(role="system", content=observation))  # Add observation to message history
-
-            self.think(state)
         else:
             logger.error(f"No tool registered for choice: {tool_name}")
             self.trace("system", f"Error: Tool {tool_name} not found")
-            # TODO: SHOULDN'T THIS MESSAGE ALSO BE ADDED??
-
-            self.think(state)
 
     def get_history(self) -> str:
-        return "\n".join([f"{message.role}: {message.content}" for message in self.messages])
+        if self.history_cache is None:
+            self.history_cache = "\n".join(self.history_parts)
+        return self.history_cache
 
     def trace(self, role: str, content: str) -> None:
-        if role != "system":
-            self.messages.append(Message(role=role, content=content))
-        write_to_file(path=self.output_trace_path, content=f"{role}: {content}\n")
+        # Every traced entry, observations included, is also part of the message history.
+        # Contents are generated internally, so the Message is built without validation.
+        self.messages.append(Message(role=role, content=content))
+        self.history_parts.append(f"{role}: {content}")
+        self.history_cache = None
+        self.trace_file.write(f"{role}: {content}\n")
 
     def execute(self, state: GlobalState) -> GlobalState:
         logger.info("DataAgent: Starting execution.")
 
         self.query = state.user_query
-        self.trace(role="user", content=self.query)
-        
-        self.think(state)
-        
+        try:
+            self.trace(role="user", content=self.query)
+
+            self.think(state)
+        finally:
+            # Trace writes are buffered by the shared file handle; flush once per run
+            self.trace_file.flush()
+
         return state
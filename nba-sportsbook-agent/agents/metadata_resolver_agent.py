@@ -1,12 +1,16 @@
+from difflib import get_close_matches
 from llm import LLMClient
-from pydantic import BaseModel, Field
-from state import GlobalState, GameDetails, GameInfo, TeamInfo, PlayerInfo, NBATeamInfo, NBAPlayerInfo
-from typing import List, Dict, Optional
-from utils import logger, write_to_file
-import json
+from state import GlobalState, Message, GameDetails, GameInfo, TeamInfo, PlayerInfo, NBATeamInfo, NBAPlayerInfo
+from typing import List, Dict, Optional, TextIO, Tuple
+from utils import dumps_json, loads_json, logger, strip_code_fence
+import re
+import unicodedata
 
 
-PROMPT = """
+# Instructions and the games/events data form the system prompt, which is identical for every query
+# against the same slate of games and can be served from the provider's prompt cache. Only the short
+# user prompt with the query changes.
+SYSTEM_PROMPT = """
 You are a Metadata Resolver Agent in an NBA sportsbook system. Your task is to reconcile and link data between two sources:
 
 1. The **NBA API**, which contains information about NBA games, teams, and players.
@@ -19,9 +23,6 @@ Your goal is to:
 
 ---
 
-### User Query:
-{query}
-
 ### NBA Games:
 Each entry includes a game_id, teams, and players.
 
@@ -70,72 +71,166 @@ Each entry includes an event_id, teams, and player names.
 }}
 """
 
-class Message(BaseModel):
-    role: str = Field(..., description="The role of the message sender (e.g., 'user', 'assistant').")
-    content: str = Field(..., description="The content of the message.")
+USER_PROMPT = """
+### User Query:
+{query}
+"""
+
+# Minimum difflib similarity for matching an NBA player name to an odds player name without the LLM
+PLAYER_MATCH_CUTOFF = 0.85
+# Name suffixes that are not a player's last name ("Jaren Jackson Jr." is asked about as "Jackson")
+NAME_SUFFIXES = {"jr", "sr", "ii", "iii", "iv"}
+
+
+def normalize_name(name: str) -> str:
+    # Lowercase, drop accents and punctuation: "Nikola Jokić" -> "nikola jokic", "P.J. Washington" -> "pj washington"
+    name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii")
+    return " ".join(re.sub(r"[^a-z0-9 ]", "", name.lower()).split())
+
+
+def players_named_in_query(players: List[Tuple[NBAPlayerInfo, str]], query: str) -> List[Tuple[NBAPlayerInfo, str]]:
+    # Players are (player, normalized name) pairs and the query is normalized. A player is named by their full
+    # name, or by their last name as a whole word outside the full names already found, so "Jalen Williams"
+    # does not also name "Jaylin Williams".
+    padded_query = f" {query} "
+    named = [(player, name) for player, name in players if f" {name} " in padded_query]
+    for _, name in named:
+        padded_query = padded_query.replace(f" {name} ", " ")
+
+    query_words = set(padded_query.split())
+    for player, name in players:
+        name_parts = [part for part in name.split() if part not in NAME_SUFFIXES]
+        if name_parts and name_parts[-1] in query_words and (player, name) not in named:
+            named.append((player, name))
+    return named
 
 
 class MetadataAgent:
-    def __init__(self, output_trace_path: str):
-        self.template = self.load_template()
-        self.output_trace_path = output_trace_path
+    def __init__(self, trace_file: TextIO, llm_client: Optional[LLMClient] = None):
+        self.system_template, self.user_template = self.load_template()
+        self.trace_file = trace_file
+
+        # The system prompt is cached together with the games and bets dicts it was built from.
+        # DataAgent assigns new dicts whenever it reloads them, so an identity check detects stale data.
+        self.system_prompt: Optional[str] = None
+        self.system_prompt_games: Optional[Dict] = None
+        self.system_prompt_bets: Optional[Dict] = None
 
-        self.llm_client = LLMClient()
+        self.llm_client = llm_client if llm_client is not None else LLMClient()
 
-    def load_template(self) -> str:
-        return PROMPT
+    def load_template(self) -> Tuple[str, str]:
+        return SYSTEM_PROMPT, USER_PROMPT
 
     def trace(self, role: str, content: str) -> None:
-        write_to_file(path=self.output_trace_path, content=f"{role}: {content}\n")
+        self.trace_file.write(f"{role}: {content}\n")
 
-    def ask_llm(self, prompt: str) -> str:
-        self.trace("user", prompt)
-        contents = [Message(role='user', content=prompt)]
-        response = self.llm_client.get_response(contents)
+    def ask_llm(self, system_prompt: str, user_prompt: str) -> str:
+        self.trace("user", system_prompt + user_prompt)
+        contents = [Message(role='system', content=system_prompt), Message(role='user', content=user_prompt)]
+        response = self.llm_client.get_response(contents, cache_system_prompt=True, stop_after_json=True)
 
         return str(response) if response else "No response from LLM"
 
-    def build_prompt(self, state: GlobalState) -> str:
-        nba_games_json = []
-        for game_id, teams in state.upcoming_games.items():
-            entry = {
+    def build_prompt(self, state: GlobalState) -> Tuple[str, str]:
+        if (self.system_prompt is None
+                or state.upcoming_games is not self.system_prompt_games
+                or state.upcoming_bets is not self.system_prompt_bets):
+            self.system_prompt = self.build_system_prompt(state)
+            self.system_prompt_games = state.upcoming_games
+            self.system_prompt_bets = state.upcoming_bets
+        else:
+            logger.info("MetadataAgent: Reusing system prompt for unchanged games and bets.")
+
+        return self.system_prompt, self.user_template.format(query=state.user_query)
+
+    def build_system_prompt(self, state: GlobalState) -> str:
+        nba_games_json = [
+            {
                 "nba_game_id": game_id,
-                "teams": [],
-            }
-            for team, players in teams.items():
-                entry["teams"].append({
-                    "nba_team_id": team.nba_team_id,
-                    "nba_team_name": team.nba_team_name,
-                    "players": [
-                        {
-                            "nba_player_id": p.nba_player_id,
-                            "nba_player_name": p.nba_player_name
-                        } for p in players
-                    ]
-                })
-            nba_games_json.append(entry)
-
-        betting_events_json = []
-        for event in state.upcoming_bets.values():
-            betting_events_json.append({
+                "teams": [
+                    {
+                        "nba_team_id": team.nba_team_id,
+                        "nba_team_name": team.nba_team_name,
+                        "players": [
+                            {
+                                "nba_player_id": p.nba_player_id,
+                                "nba_player_name": p.nba_player_name
+                            } for p in players
+                        ]
+                    } for team, players in teams.items()
+                ]
+            } for game_id, teams in state.upcoming_games.items()
+        ]
+
+        betting_events_json = [
+            {
                 "odd_game_id": event.event_id,
                 "home_team": event.home_team,
                 "away_team": event.away_team,
                 "player_names": event.get_all_player_names()
-            })
+            } for event in state.upcoming_bets.values()
+        ]
+
+        # Compact separators: the model reads compact JSON just as well, and it costs fewer prompt tokens
+        return self.system_template.format(
+            nba_games_json=dumps_json(nba_games_json),
+            betting_events_json=dumps_json(betting_events_json)
+        )
+
+    def resolve_single_game(self, state: GlobalState) -> Optional[GameDetails]:
+        # With exactly one game and one betting event there is nothing for the LLM to disambiguate.
+        # Teams are matched on their full normalized name or their abbreviation, and only the players
+        # named in the query are mapped (as the LLM is instructed to), on their normalized name,
+        # falling back to the closest difflib match.
+        (nba_game_id, teams), = state.upcoming_games.items()
+        (odds_game_id, event), = state.upcoming_bets.items()
+
+        nba_teams_by_name = {}
+        for team in teams:
+            nba_teams_by_name[normalize_name(team.nba_team_name)] = team
+            if team.nba_team_abbreviation:
+                nba_teams_by_name[normalize_name(team.nba_team_abbreviation)] = team
+        home_team = nba_teams_by_name.get(normalize_name(event.home_team))
+        away_team = nba_teams_by_name.get(normalize_name(event.away_team))
+        if home_team is None or away_team is None or home_team is away_team:
+            return None
+
+        # Exact matches are claimed first, then fuzzy matching only considers odds names nobody claimed, so two
+        # similar names ("Jaylin Williams" / "Jalen Williams") can never map to the same odds player
+        odds_names = {normalize_name(name): name for name in event.get_all_player_names()}
+        players = players_named_in_query(
+            [(player, normalize_name(player.nba_player_name)) for team_players in teams.values() for player in team_players],
+            normalize_name(state.user_query)
+        )
+        matched_names = {}
+        for player, player_name in players:
+            if player_name in odds_names:
+                matched_names[player.nba_player_id] = player_name
+        unclaimed_names = set(odds_names) - set(matched_names.values())
+        for player, player_name in players:
+            if player.nba_player_id in matched_names or not unclaimed_names:
+                continue
+            matches = get_close_matches(player_name, unclaimed_names, n=1, cutoff=PLAYER_MATCH_CUTOFF)
+            if matches:
+                matched_names[player.nba_player_id] = matches[0]
+                unclaimed_names.discard(matches[0])
+
+        players_info = [
+            PlayerInfo(nba_player_id=player.nba_player_id, odds_player_name=odds_names[matched_names[player.nba_player_id]])
+            for player, _ in players if player.nba_player_id in matched_names
+        ]
 
-        return self.template.format(
-            nba_games_json=json.dumps(nba_games_json, indent=2),
-            betting_events_json=json.dumps(betting_events_json, indent=2),
-            query=state.user_query
+        return GameDetails(
+            game_info=GameInfo(nba_game_id=nba_game_id, odds_game_id=odds_game_id),
+            home_team_info=TeamInfo(nba_team_id=home_team.nba_team_id, odds_team_name=event.home_team),
+            away_team_info=TeamInfo(nba_team_id=away_team.nba_team_id, odds_team_name=event.away_team),
+            players_info=players_info
         )
 
     def parse_game_details(self, response: str) -> GameDetails:
-        cleaned = response.strip().strip('`').strip()
-        if cleaned.startswith("json"):
-            cleaned = cleaned[4:].strip()
+        cleaned = strip_code_fence(response)
 
-        answer = json.loads(cleaned, strict=False)
+        answer = loads_json(cleaned)
         data = answer.get("answer")
 
         game_info = GameInfo(**data["game_info"])
@@ -154,17 +249,28 @@ class MetadataAgent:
     def execute(self, state: GlobalState) -> GlobalState:
         logger.info("MetadataAgent: Starting execution.")
         
-        prompt = self.build_prompt(state)
-        response = self.ask_llm(prompt)
-
-        logger.info(f"MetadataAgent LLM response: {response}")
-        self.trace("assistant", response)
-
         try:
-            game_details = self.parse_game_details(response)
-            state.game_details = game_details
-        except Exception as e:
-            logger.error(f"Failed to parse LLM response in MetadataAgent: {e}")
-            self.trace("system", f"MetadataAgent failed to parse: {e}")
+            if len(state.upcoming_games) == 1 and len(state.upcoming_bets) == 1:
+                game_details = self.resolve_single_game(state)
+                if game_details is not None:
+                    logger.info("MetadataAgent: Resolved the only upcoming game without calling the LLM.")
+                    self.trace("system", f"MetadataAgent resolved the only upcoming game: {game_details}")
+                    state.game_details = game_details
+                    return state
+
+            system_prompt, user_prompt = self.build_prompt(state)
+            response = self.ask_llm(system_prompt, user_prompt)
+
+            logger.info(f"MetadataAgent LLM response: {response}")
+            self.trace("assistant", response)
+
+            try:
+                game_details = self.parse_game_details(response)
+                state.game_details = game_details
+            except Exception as e:
+                logger.error(f"Failed to parse LLM response in MetadataAgent: {e}")
+                self.trace("system", f"MetadataAgent failed to parse: {e}")
+        finally:
+            self.trace_file.flush()
 
         return state
@@ -1,10 +1,26 @@
-from dotenv import load_dotenv
 from openai import OpenAI
-from typing import List, Dict, Optional
-from utils import logger
+from typing import Any, Iterator, List, Dict, Optional, Tuple
+from utils import JsonObjectScanner, logger
+import hashlib
 import os
+import sqlite3
+import threading
+
+# Transient API failures (connection errors, 408/409/429/5xx) are retried by the OpenAI client with exponential backoff
+LLM_MAX_RETRIES = 3
+
+# OpenAI clients keyed by (api_key, base_url), so every LLMClient for the same endpoint shares one connection pool
+_openai_clients: Dict[Tuple[str, str], OpenAI] = {}
+_openai_clients_lock = threading.Lock()
+
+
+def get_openai_client(api_key: str, base_url: str) -> OpenAI:
+    with _openai_clients_lock:
+        client = _openai_clients.get((api_key, base_url))
+        if client is None:
+            client = _openai_clients[(api_key, base_url)] = OpenAI(base_url=base_url, api_key=api_key, max_retries=LLM_MAX_RETRIES)
+        return client
 
-load_dotenv()
 
 class LLMClient:
     DEFAULT_MODEL: str = "mistralai/mistral-small-3.1-24b-instruct:free"
@@ -25,20 +41,38 @@ class LLMClient:
         self.base_url = base_url if base_url is not None else self.DEFAULT_BASE_URL
 
         try:
-            self.client = OpenAI(
-                base_url=self.base_url,
-                api_key=self.api_key,
-            )
+            self.client = get_openai_client(self.api_key, self.base_url)
             logger.info(f"LLMClient initialized with model: {self.model_name}, base_url: {self.base_url}")
         except Exception as e:
             logger.error(f"Failed to initialize OpenAI client: {e}", exc_info=True)
             raise
 
-    def get_response(self, messages) -> Optional[str]:
+    def build_messages(self, messages, cache_system_prompt: bool = False) -> List[Dict[str, Any]]:
+        payload = []
+        for message in messages:
+            content = message.content
+            if cache_system_prompt and message.role == "system":
+                # Mark the static prefix as a prompt cache breakpoint. Providers without explicit
+                # caching ignore it and still benefit from the stable prefix ordering.
+                content = [{"type": "text", "text": content, "cache_control": {"type": "ephemeral"}}]
+            payload.append({"role": message.role, "content": content})
+        return payload
+
+    def get_response(self, messages, cache_system_prompt: bool = False, stream: bool = True, stop_after_json: bool = False) -> Optional[str]:
+        if stream:
+            # Streaming lets stop_after_json cut generation short once the response object is complete.
+            # A stream that fails part way is treated like any other failed call, never as a complete response.
+            try:
+                content = "".join(self.stream_response(messages, cache_system_prompt=cache_system_prompt, stop_after_json=stop_after_json))
+            except Exception:
+                return None
+            logger.debug(f"Received response from {self.model_name}: {content}")
+            return content or None
+
         try:
             response = self.client.chat.completions.create(
                 model=self.model_name,
-                messages=messages
+                messages=self.build_messages(messages, cache_system_prompt=cache_system_prompt)
             )
             if response.choices and response.choices[0].message:
                 content = response.choices[0].message.content
@@ -47,6 +81,85 @@ class LLMClient:
             else:
                 logger.warning(f"Received no valid choices or message content from {self.model_name}.")
         except Exception as e:
-            logger.error(f"An unexpected error occurred while calling LLM API ({self.model_name}): {e}", exc_info=True)
+            logger.error(f"An unexpected error occurred while calling LLM API ({self.model_name}): {e}")
+            # Tracebacks are only formatted when debug logging is enabled
+            logger.debug("LLM API call traceback", exc_info=True)
+
+        return None
+
+    def stream_response(self, messages, cache_system_prompt: bool = False, stop_after_json: bool = False) -> Iterator[str]:
+        # Yields content chunks as they arrive. With stop_after_json, the stream is closed as soon as the
+        # first top-level JSON object is complete, so trailing tokens are never generated or paid for.
+        # An error after the stream has started is logged and re-raised, so partial output is never taken as complete.
+        try:
+            stream = self.client.chat.completions.create(
+                model=self.model_name,
+                messages=self.build_messages(messages, cache_system_prompt=cache_system_prompt),
+                stream=True
+            )
+        except Exception as e:
+            logger.error(f"An unexpected error occurred while calling LLM API ({self.model_name}): {e}")
+            logger.debug("LLM API call traceback", exc_info=True)
+            return
+
+        scanner = JsonObjectScanner() if stop_after_json else None
+        try:
+            for chunk in stream:
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                content = chunk.choices[0].delta.content
+                if scanner is not None:
+                    end = scanner.feed(content)
+                    if end != -1:
+                        yield content[:end]
+                        logger.debug(f"Complete JSON object received from {self.model_name}, closing stream.")
+                        return
+                yield content
+        except Exception as e:
+            logger.error(f"An unexpected error occurred while streaming from LLM API ({self.model_name}): {e}")
+            logger.debug("LLM API call traceback", exc_info=True)
+            raise
+        finally:
+            stream.close()
+
+
+class ResponseCache:
+    """Exact-match result cache, persisted in a SQLite file and keyed by a hash of the model and messages.
+
+    Callers store a response only once it has been parsed into an answer, so a failed or malformed
+    LLM response is never replayed; it is not a transparent cache of every get_response call.
+    """
+
+    def __init__(self, path: str):
+        cache_dir = os.path.dirname(path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL)")
+        self.conn.commit()
+        logger.info(f"ResponseCache initialized at: {self.path}")
+
+    @staticmethod
+    def make_key(model_name: str, messages) -> str:
+        digest = hashlib.blake2b(digest_size=32)
+        digest.update(model_name.encode("utf-8"))
+        for message in messages:
+            digest.update(b"\0" + message.role.encode("utf-8") + b"\0" + message.content.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, response: str) -> None:
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO responses (key, response) VALUES (?, ?)", (key, response))
+            self.conn.commit()
 
-        return None
\ No newline at end of file
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
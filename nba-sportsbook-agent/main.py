@@ -1,39 +1,56 @@
 from agents.data_agent import DataAgent
 from agents.metadata_resolver_agent import MetadataAgent
 from agents.analysis_agent import AnalysisAgent
+from dotenv import load_dotenv
+from llm import LLMClient
 from langgraph.graph import StateGraph, END
 from state import GlobalState
-from utils import logger
+from utils import AppendWriter, logger
+import asyncio
 import os
 import sys
 
 
 if __name__ == "__main__":
+    load_dotenv()
     logger.info("NBA Sportsbook Agent starting...")
 
     OUTPUT_TRACE_PATH = os.getenv("NBA_OUTPUT_TRACE_PATH", "output/output.txt")
     logger.info(f"Output trace path set to: {OUTPUT_TRACE_PATH}")
 
+    # One buffered handle shared by all agents; each agent flushes it at the end of its run
+    output_trace_dir = os.path.dirname(OUTPUT_TRACE_PATH)
+    if output_trace_dir:
+        os.makedirs(output_trace_dir, exist_ok=True)
+    trace_file = AppendWriter(OUTPUT_TRACE_PATH)
+
+    LLM_RESPONSE_CACHE_PATH = os.getenv("NBA_LLM_RESPONSE_CACHE_PATH", "cache/llm_responses.sqlite")
+    logger.info(f"LLM response cache path set to: {LLM_RESPONSE_CACHE_PATH}")
+
     logger.info("Initializing agents...")
     try:
-        data_agent = DataAgent(OUTPUT_TRACE_PATH)
-        metadata_agent = MetadataAgent(OUTPUT_TRACE_PATH)
-        analysis_agent = AnalysisAgent(OUTPUT_TRACE_PATH)
+        # One client (and one HTTP connection pool) is shared by all agents
+        llm_client = LLMClient()
+        data_agent = DataAgent(trace_file, llm_client=llm_client)
+        metadata_agent = MetadataAgent(trace_file, llm_client=llm_client)
+        analysis_agent = AnalysisAgent(trace_file, response_cache_path=LLM_RESPONSE_CACHE_PATH, llm_client=llm_client)
         logger.info("Agents initialized successfully.")
     except Exception as e:
         logger.error(f"Failed to initialize agents: {e}", exc_info=True)
         sys.exit(1)
 
-    def data_node(state: GlobalState) -> GlobalState:
-        result = data_agent.execute(state)
+    # The agents do blocking network I/O, so each node runs its agent in a worker thread and
+    # keeps the event loop free while the graph is driven with ainvoke
+    async def data_node(state: GlobalState) -> GlobalState:
+        result = await asyncio.to_thread(data_agent.execute, state)
         return result
 
-    def metadata_node(state: GlobalState) -> GlobalState:
-        result = metadata_agent.execute(state)
+    async def metadata_node(state: GlobalState) -> GlobalState:
+        result = await asyncio.to_thread(metadata_agent.execute, state)
         return result
 
-    def analysis_node(state: GlobalState) -> GlobalState:
-        result = analysis_agent.execute(state)
+    async def analysis_node(state: GlobalState) -> GlobalState:
+        result = await asyncio.to_thread(analysis_agent.execute, state)
         return result
 
     def data_check(state: GlobalState) -> str:
@@ -61,6 +78,11 @@ if __name__ == "__main__":
 
     initial_state = GlobalState(user_query=user_query)
     logger.info(f"Invoking graph with initial state: {initial_state}")
-    final_state = graph.invoke(initial_state)
+    try:
+        final_state = asyncio.run(graph.ainvoke(initial_state))
+    finally:
+        trace_file.close()
+        if analysis_agent.response_cache is not None:
+            analysis_agent.response_cache.close()
     logger.info(f"Graph execution finished. Final state: {final_state}")
     logger.info("NBA Sportsbook Agent finished.")
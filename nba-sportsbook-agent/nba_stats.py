@@ -1,101 +1,228 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from nba_api.stats.endpoints import boxscoresummaryv2, boxscoretraditionalv2, commonteamroster, playergamelog, scoreboardv2, teamgamelog
+from nba_api.stats.library.http import NBAStatsHTTP
 from nba_api.stats.static import players, teams
+from requests.adapters import HTTPAdapter
 from utils import logger
+import json
+import numpy as np
 import pandas as pd
+import random
+import requests
+import threading
+import time
+
+
+# Game log dates look like "APR 13, 2025"; an explicit format skips pandas' per-value format inference
+GAME_LOG_DATE_FORMAT = '%b %d, %Y'
+
+# Timeouts, dropped connections and throttled responses (which come back as HTTP errors or non-JSON bodies) are transient
+RETRYABLE_ERRORS = (requests.exceptions.Timeout, requests.exceptions.ConnectionError, requests.exceptions.HTTPError, json.JSONDecodeError)
+
+
+class TokenBucket:
+    """Thread-safe token bucket: allows bursts of up to capacity calls, refilled at rate tokens per second."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
 
 
 class NBAStatsAPI:
+    # stats.nba.com throttles aggressive clients; at most this many requests are in flight at once
+    MAX_CONCURRENT_REQUESTS = 8
+    MAX_PLAYER_WORKERS = 8
+    # Sustained request rate across all threads; bursts of up to MAX_CONCURRENT_REQUESTS are allowed
+    MAX_REQUESTS_PER_SECOND = 4
+    ROSTER_TTL_SECONDS = 6 * 3600
+    # Failed requests are retried with exponential backoff plus jitter, capped at RETRY_MAX_DELAY seconds
+    MAX_REQUEST_ATTEMPTS = 4
+    RETRY_BASE_DELAY = 0.3
+    RETRY_MAX_DELAY = 3.0
+
     def __init__(self, current_season='2024-25', season_types = ['Pre Season', 'Regular Season', 'Playoffs', 'PlayIn']):
         self.CURRENT_SEASON = current_season
         self.SEASON_TYPES = season_types
 
+        # Teams and players do not change while the process runs, so they are fetched once. Rosters change
+        # with trades and signings, so they are cached for ROSTER_TTL_SECONDS. Callers must treat the
+        # returned frames as read-only.
+        self.cache_lock = threading.Lock()
+        self.teams_df = None
+        self.players_df = None
+        self.team_players_dfs = {}  # (team_id, season) -> (fetched_at, roster DataFrame)
+
+        self.request_semaphore = threading.BoundedSemaphore(self.MAX_CONCURRENT_REQUESTS)
+
+        # nba_api sends every stats.nba.com request through one class-level session; install ours so its
+        # keep-alive pool is sized to MAX_CONCURRENT_REQUESTS. Retries are handled by call_endpoint, not the adapter.
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=self.MAX_CONCURRENT_REQUESTS))
+        NBAStatsHTTP.set_session(self.session)
+        self.rate_limiter = TokenBucket(self.MAX_REQUESTS_PER_SECOND, self.MAX_CONCURRENT_REQUESTS)
+
+    def call_endpoint(self, endpoint, **params):
+        # Every stats.nba.com request goes through here, so concurrency, retries and timing are handled in one place
+        for attempt in range(1, self.MAX_REQUEST_ATTEMPTS + 1):
+            self.rate_limiter.acquire()
+            start = time.perf_counter()
+            try:
+                with self.request_semaphore:
+                    result = endpoint(**params)
+                logger.debug(f"{endpoint.__name__} {params} took {time.perf_counter() - start:.2f}s (attempt {attempt}).")
+                return result
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.MAX_REQUEST_ATTEMPTS:
+                    raise
+                delay = min(self.RETRY_MAX_DELAY, self.RETRY_BASE_DELAY * 2 ** (attempt - 1)) + random.uniform(0, self.RETRY_BASE_DELAY)
+                logger.warning(f"{endpoint.__name__} {params} failed after {time.perf_counter() - start:.2f}s (attempt {attempt}): {e}. Retrying in {delay:.2f}s.")
+                time.sleep(delay)
+
     def get_teams(self):
+        if self.teams_df is not None:
+            return self.teams_df
+
         logger.debug("Fetching all NBA teams.")
         try:
             nba_teams_data = teams.get_teams()
             df_teams = pd.DataFrame(nba_teams_data)
             logger.info(f"Successfully fetched {len(df_teams)} NBA teams.")
+            self.teams_df = df_teams
             return df_teams
         except Exception as e:
             logger.error(f"Error fetching NBA teams: {e}", exc_info=True)
             raise
 
     def get_all_players(self):
+        if self.players_df is not None:
+            return self.players_df
+
         logger.debug("Fetching all NBA players.")
         try:
             all_players_data = players.get_players()
             df_players = pd.DataFrame(all_players_data)
             logger.info(f"Successfully fetched {len(df_players)} players.")
+            self.players_df = df_players
             return df_players
         except Exception as e:
             logger.error(f"Error fetching all NBA players: {e}", exc_info=True)
             raise
 
     def get_team_players(self, team_id):
+        cache_key = (team_id, self.CURRENT_SEASON)
+        with self.cache_lock:
+            cached = self.team_players_dfs.get(cache_key)
+        if cached is not None and time.monotonic() - cached[0] < self.ROSTER_TTL_SECONDS:
+            logger.debug(f"Using cached team roster for team_id: {team_id}, season: {self.CURRENT_SEASON}.")
+            return cached[1]
+
         logger.debug(f"Fetching team roster for team_id: {team_id}, season: {self.CURRENT_SEASON}.")
         try:
-            roster = commonteamroster.CommonTeamRoster(team_id=team_id, season=self.CURRENT_SEASON)
+            roster = self.call_endpoint(commonteamroster.CommonTeamRoster, team_id=team_id, season=self.CURRENT_SEASON)
             players_df = roster.get_data_frames()[0]  # First DataFrame contains the player info
             if players_df.empty:
                 logger.info(f"No players found for team_id: {team_id}, season: {self.CURRENT_SEASON}.")
             else:
                 logger.info(f"Successfully fetched {len(players_df)} players for team_id: {team_id}, season: {self.CURRENT_SEASON}.")
+                with self.cache_lock:
+                    self.team_players_dfs[cache_key] = (time.monotonic(), players_df)
             return players_df
         except Exception as e:
             logger.error(f"Error fetching team roster for team_id {team_id}: {e}", exc_info=True)
             raise
 
+    def get_team_players_batch(self, team_ids):
+        # Rosters are independent requests, so they are fetched concurrently; request_semaphore bounds the load
+        team_ids = list(dict.fromkeys(team_ids))
+        if not team_ids:
+            return {}
+
+        with ThreadPoolExecutor(max_workers=min(self.MAX_PLAYER_WORKERS, len(team_ids))) as executor:
+            return dict(zip(team_ids, executor.map(self.get_team_players, team_ids)))
+
     def get_upcoming_games(self, days_ahead=1):
         logger.debug(f"Fetching upcoming games for {days_ahead} days ahead.")
         all_games_list = []
         try:
-            for i in range(days_ahead + 1):  # Include today
-                game_date_str = (datetime.today() + timedelta(days=i)).strftime('%m/%d/%Y')
+            game_dates = [(datetime.today() + timedelta(days=i)).strftime('%m/%d/%Y') for i in range(days_ahead + 1)]  # Include today
+
+            def fetch_scoreboard(game_date_str):
                 logger.debug(f"Fetching games for date: {game_date_str}")
-                scoreboard = scoreboardv2.ScoreboardV2(game_date=game_date_str)
-                games_df = scoreboard.get_data_frames()[0]
-                all_games_list.append(games_df)
+                scoreboard = self.call_endpoint(scoreboardv2.ScoreboardV2, game_date=game_date_str)
+                return scoreboard.get_data_frames()[0]
 
-            if not all_games_list:
+            # Each date is an independent request, so fetch them concurrently
+            with ThreadPoolExecutor(max_workers=len(game_dates)) as executor:
+                all_games_list.extend(executor.map(fetch_scoreboard, game_dates))
+
+            all_games_df = pd.concat(all_games_list, ignore_index=True, sort=False)
+            if all_games_df.empty:
                 logger.info("No upcoming games found within the specified range.")
-                return pd.DataFrame()
+                return all_games_df
 
-            all_games_df = pd.concat(all_games_list, ignore_index=True)
-            all_games_df = all_games_df.sort_values(by="GAME_DATE_EST")
+            all_games_df = all_games_df.sort_values(by="GAME_DATE_EST", kind='mergesort', ignore_index=True)
             logger.info(f"Successfully fetched {len(all_games_df)} upcoming games.")
             return all_games_df
         except Exception as e:
             logger.error(f"Error fetching upcoming games: {e}", exc_info=True)
             raise
 
+    def get_season_game_logs(self, endpoint, log_name, **endpoint_params):
+        # One request per season type. They are independent network calls, so they run concurrently
+        # and the wall time is the slowest call instead of the sum. Logs are concatenated in SEASON_TYPES order.
+        def fetch_season_type(season_type):
+            logger.debug(f"Fetching {log_name} game log for season type: {season_type}")
+            game_log = self.call_endpoint(
+                endpoint,
+                season=self.CURRENT_SEASON,
+                season_type_all_star=season_type, # Corrected parameter name
+                **endpoint_params
+            )
+            df = game_log.get_data_frames()[0]
+            if df.empty:
+                logger.debug(f"No {log_name} game log data for {endpoint_params}, season {self.CURRENT_SEASON}, type {season_type}.")
+            return df
+
+        with ThreadPoolExecutor(max_workers=len(self.SEASON_TYPES)) as executor:
+            season_dfs = list(executor.map(fetch_season_type, self.SEASON_TYPES))
+
+        sizes = [len(df) for df in season_dfs]
+        if not any(sizes):
+            return pd.DataFrame()
+
+        all_games_df = pd.concat([df for df in season_dfs if not df.empty], ignore_index=True, sort=False)
+        # Tag the game type once on the combined frame instead of adding a column to every season's frame
+        all_games_df['SEASON_TYPE'] = pd.Categorical.from_codes(np.repeat(np.arange(len(sizes)), sizes), categories=self.SEASON_TYPES)
+        all_games_df['GAME_DATE_DT'] = pd.to_datetime(all_games_df['GAME_DATE'], format=GAME_LOG_DATE_FORMAT, cache=True)
+        return all_games_df
+
     def get_team_stats(self, team_id):
         logger.debug(f"Fetching team game logs for team_id: {team_id}, season: {self.CURRENT_SEASON}.")
-        all_games_list = []
         try:
-            for season_type in self.SEASON_TYPES:
-                logger.debug(f"Fetching team game log for season type: {season_type}")
-                # time.sleep(0.1) # Consider delay
-                game_log = teamgamelog.TeamGameLog(
-                    team_id=team_id,
-                    season=self.CURRENT_SEASON,
-                    season_type_all_star=season_type # Corrected parameter name
-                )
-                df = game_log.get_data_frames()[0]
-                if not df.empty:
-                    df['SEASON_TYPE'] = season_type  # Tag the game type
-                    all_games_list.append(df)
-                else:
-                    logger.debug(f"No team game log data for team_id {team_id}, season {self.CURRENT_SEASON}, type {season_type}.")
-
-
-            if not all_games_list:
+            all_games_df = self.get_season_game_logs(teamgamelog.TeamGameLog, "team", team_id=team_id)
+
+            if all_games_df.empty:
                 logger.info(f"No team game logs found for team_id: {team_id}, season: {self.CURRENT_SEASON} across all season types.")
                 return pd.DataFrame()
 
-            all_games_df = pd.concat(all_games_list, ignore_index=True)
-            all_games_df['GAME_DATE_DT'] = pd.to_datetime(all_games_df['GAME_DATE'])
-            all_games_df = all_games_df.sort_values(by='GAME_DATE_DT', ascending=False)
+            # Stable sort, so games on the same date keep their SEASON_TYPES order
+            all_games_df = all_games_df.sort_values(by='GAME_DATE_DT', ascending=False, kind='mergesort', ignore_index=True)
             logger.info(f"Successfully fetched {len(all_games_df)} team game log entries for team_id: {team_id}.")
             return all_games_df
         except Exception as e:
@@ -105,9 +232,9 @@ class NBAStatsAPI:
     def get_game_summary(self, game_id):
         logger.debug(f"Fetching game summary for game_id: {game_id}.")
         try:
-            box_score_summary = boxscoresummaryv2.BoxScoreSummaryV2(game_id=game_id)
-            # Index 5 corresponds to the 'LineScore' DataFrame in the BoxScoreSummaryV2 endpoint
-            df_summary = box_score_summary.get_data_frames()[5]
+            box_score_summary = self.call_endpoint(boxscoresummaryv2.BoxScoreSummaryV2, game_id=game_id)
+            # Only the LineScore data set is used; get_data_frames() would build a DataFrame for every data set
+            df_summary = box_score_summary.line_score.get_data_frame()
             if df_summary.empty:
                  logger.info(f"No game summary (LineScore) found for game_id: {game_id}.")
             else:
@@ -120,12 +247,10 @@ class NBAStatsAPI:
     def get_game_stats(self, game_id):
         logger.debug(f"Fetching game stats for game_id: {game_id}.")
         try:
-            box_score = boxscoretraditionalv2.BoxScoreTraditionalV2(game_id=game_id)
-            data_frames = box_score.get_data_frames()
-
-            player_stats_df = data_frames[0]    # PlayerStats
-            team_starter_bench_stats_df = data_frames[1]    # TeamStarterBenchStats
-            team_stats_df = data_frames[2]    # TeamStats
+            box_score = self.call_endpoint(boxscoretraditionalv2.BoxScoreTraditionalV2, game_id=game_id)
+            # Build DataFrames only for the data sets that are returned (TeamStarterBenchStats is unused)
+            player_stats_df = box_score.player_stats.get_data_frame()
+            team_stats_df = box_score.team_stats.get_data_frame()
 
             if player_stats_df.empty and team_stats_df.empty:
                  logger.info(f"No player or team stats found for game_id: {game_id}.")
@@ -138,33 +263,35 @@ class NBAStatsAPI:
 
     def get_player_stats(self, player_id):
         logger.debug(f"Fetching player game logs for player_id: {player_id}, season: {self.CURRENT_SEASON}.")
-        all_games_list = []
         try:
-            for season_type in self.SEASON_TYPES:
-                logger.debug(f"Fetching player game log for season type: {season_type}")
-                # time.sleep(0.1) # Consider delay
-                game_log = playergamelog.PlayerGameLog(
-                    player_id=player_id,
-                    season=self.CURRENT_SEASON,
-                    season_type_all_star=season_type # Corrected parameter name
-                )
-                df = game_log.get_data_frames()[0]
-                if not df.empty:
-                    df['SEASON_TYPE'] = season_type
-                    all_games_list.append(df)
-                else:
-                    logger.debug(f"No player game log data for player_id {player_id}, season {self.CURRENT_SEASON}, type {season_type}.")
-
-
-            if not all_games_list:
+            all_games_df = self.get_season_game_logs(playergamelog.PlayerGameLog, "player", player_id=player_id)
+
+            if all_games_df.empty:
                 logger.info(f"No player game logs found for player_id: {player_id}, season: {self.CURRENT_SEASON} across all season types.")
                 return pd.DataFrame()
 
-            all_games_df = pd.concat(all_games_list, ignore_index=True)
-            all_games_df['GAME_DATE_DT'] = pd.to_datetime(all_games_df['GAME_DATE'])
-            all_games_df = all_games_df.sort_values(by='GAME_DATE_DT', ascending=False)
+            # Stable sort, so games on the same date keep their SEASON_TYPES order
+            all_games_df = all_games_df.sort_values(by='GAME_DATE_DT', ascending=False, kind='mergesort', ignore_index=True)
             logger.info(f"Successfully fetched {len(all_games_df)} player game log entries for player_id: {player_id}.")
             return all_games_df
         except Exception as e:
             logger.error(f"Error fetching player stats for player_id {player_id}: {e}", exc_info=True)
             raise
+
+    def get_player_stats_batch(self, player_ids):
+        # Players are fetched concurrently on top of the per-season-type fan-out in get_player_stats;
+        # request_semaphore and rate_limiter keep the in-flight requests and the request rate bounded
+        player_ids = list(player_ids)
+        if not player_ids:
+            return {}
+
+        # A player whose stats cannot be fetched is logged and left out, so the others are still returned
+        stats_by_player_id = {}
+        with ThreadPoolExecutor(max_workers=min(self.MAX_PLAYER_WORKERS, len(player_ids))) as executor:
+            futures = {player_id: executor.submit(self.get_player_stats, player_id) for player_id in player_ids}
+            for player_id, future in futures.items():
+                try:
+                    stats_by_player_id[player_id] = future.result()
+                except Exception as e:
+                    logger.error(f"Skipping player_id {player_id} after failing to fetch stats: {e}")
+        return stats_by_player_id
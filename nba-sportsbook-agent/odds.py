@@ -1,12 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
-from utils import logger
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from utils import loads_json, logger
 import os
 import requests
 
-load_dotenv()
-
 
 class OddsAPIClient:
     ODDS_API_BASE_URL = "https://api.the-odds-api.com/v4"
@@ -29,6 +28,17 @@ class OddsAPIClient:
         "player_points_rebounds_assists_alternate",
     ]
     ALL_MARKETS = MAIN_MARKETS + ALTERNATE_MARKETS + PLAYER_MARKETS
+    # Markets requested when the caller does not ask for specific ones. The payload grows with every
+    # market, so only the core player props (and their alternate lines) are fetched by default.
+    CORE_PLAYER_MARKETS = [
+        "player_points", "player_rebounds", "player_assists", "player_threes",
+        "player_points_rebounds_assists",
+    ]
+    DEFAULT_MARKETS = MAIN_MARKETS + CORE_PLAYER_MARKETS + [f"{market}_alternate" for market in CORE_PLAYER_MARKETS]
+    # Upper bound on concurrent event odds requests
+    MAX_ODDS_WORKERS = 8
+    # (connect, read) timeouts in seconds; odds payloads with all markets can be large
+    REQUEST_TIMEOUT = (5, 30)
     FAVOURITE_BOOKMAKERS = [
        "fanduel",
        # "draftkings",
@@ -40,6 +50,13 @@ class OddsAPIClient:
         if not self.api_key:
             logger.error("ODDS_API_KEY not found in environment variables or provided during instantiation.")
             raise ValueError("ODDS_API_KEY is required to use OddsAPIClient.")
+
+        # One pooled session keeps TLS connections alive across requests; rate limits and
+        # transient server errors are retried with backoff
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET"])
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.MAX_ODDS_WORKERS, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
         
         logger.info("OddsAPIClient initialized successfully.")
 
@@ -49,9 +66,9 @@ class OddsAPIClient:
         
         logger.debug(f"Fetching sports from URL: {url}")
         try:
-            response = requests.get(url, params=params)
+            response = self.session.get(url, params=params, timeout=self.REQUEST_TIMEOUT)
             response.raise_for_status()  # Raises HTTPError for bad responses (4xx or 5xx)
-            data = response.json()
+            data = loads_json(response.content)
             logger.info(f"Successfully fetched {len(data)} sports.")
             return data
         except Exception as e:
@@ -74,9 +91,9 @@ class OddsAPIClient:
 
         logger.debug(f"Fetching events for sport '{sport}' from URL: {url} with params: {params}")
         try:
-            response = requests.get(url, params=params)
+            response = self.session.get(url, params=params, timeout=self.REQUEST_TIMEOUT)
             response.raise_for_status()
-            data = response.json()
+            data = loads_json(response.content)
             logger.info(f"Successfully fetched {len(data)} events for sport '{sport}'.")
             return data
         except Exception as e:
@@ -86,7 +103,7 @@ class OddsAPIClient:
     def get_event_odds(self, event_id, sport="basketball_nba", markets=None, bookmakers=None):
         url = f"{self.ODDS_API_BASE_URL}/sports/{sport}/events/{event_id}/odds"
         
-        markets_str = ",".join(markets) if markets is not None else ",".join(self.ALL_MARKETS)
+        markets_str = ",".join(markets) if markets is not None else ",".join(self.DEFAULT_MARKETS)
         bookmakers_str = ",".join(bookmakers) if bookmakers is not None else ",".join(self.FAVOURITE_BOOKMAKERS)
         
         params = {
@@ -98,11 +115,24 @@ class OddsAPIClient:
 
         logger.debug(f"Fetching odds for event_id '{event_id}' (sport: '{sport}') from URL: {url} with params: {params}")
         try:
-            response = requests.get(url, params=params)
+            response = self.session.get(url, params=params, timeout=self.REQUEST_TIMEOUT)
             response.raise_for_status()
-            data = response.json()
+            data = loads_json(response.content)
             logger.info(f"Successfully fetched odds for event_id '{event_id}'.")
             return data
         except Exception as e:
             logger.error(f"An error occurred while fetching odds for event_id '{event_id}': {e}. URL: {url}", exc_info=True)
             return {}
+
+    def get_events_odds(self, event_ids, sport="basketball_nba", markets=None, bookmakers=None):
+        # Odds are fetched per event; the requests are independent, so they run concurrently and
+        # the total latency is roughly one round trip per MAX_ODDS_WORKERS events instead of one per event
+        event_ids = list(event_ids)
+        if not event_ids:
+            return {}
+
+        def fetch(event_id):
+            return self.get_event_odds(event_id, sport=sport, markets=markets, bookmakers=bookmakers)
+
+        with ThreadPoolExecutor(max_workers=min(self.MAX_ODDS_WORKERS, len(event_ids))) as executor:
+            return dict(zip(event_ids, executor.map(fetch, event_ids)))
@@ -1,18 +1,32 @@
-from collections import defaultdict
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional
+from functools import cached_property
+from typing import Dict, List, Optional, Tuple
 import pandas as pd
 import pickle
 
 
+############# LLM #############
+@dataclass(slots=True)
+class Message:
+	role: str  # The role of the message sender (e.g., 'user', 'assistant')
+	content: str  # The content of the message
+
+
 ############# Odds API #############
 class BetOutcome:
+    # An event payload holds thousands of outcomes; slots keep each one small
+    __slots__ = ("name", "price", "point", "description")
+
     def __init__(self, name: str, price: float, point: Optional[float] = None, description: Optional[str] = None):
         self.name = name
         self.price = price
         self.point = point
         self.description = description
 
+    @classmethod
+    def from_dict(cls, outcome_data: dict) -> "BetOutcome":
+        return cls(outcome_data["name"], outcome_data["price"], outcome_data.get("point"), outcome_data.get("description"))
+
     def __repr__(self):
         return f"BetOutcome(name={self.name}, price={self.price}, point={self.point}, description={self.description})"
 
@@ -26,36 +40,59 @@ class BetMarket:
         return f"BetMarket(key={self.key}, outcomes={len(self.outcomes)})"
 
 
-def default_dict_of_lists():
-    return defaultdict(list)
-
-
 class BetMarketGroup:
     def __init__(self):
         self.markets: Dict[str, BetMarket] = {}
-        self.description_index: Dict[str, Dict[str, List[BetOutcome]]] = defaultdict(default_dict_of_lists)
 
     def add_market(self, key: str, market: BetMarket):
         self.markets[key] = market
-        for outcome in market.outcomes:
-            # Use 'description' if available (player/team), else fall back to 'name' (e.g. for spreads)
-            ref = outcome.description or outcome.name
-            if ref:
-                self.description_index[ref][key].append(outcome)
+        # Drop the indexes if they were already built; they are rebuilt on next use
+        self.__dict__.pop("outcome_index", None)
+        self.__dict__.pop("market_keys_by_ref", None)
+
+    @cached_property
+    def outcome_index(self) -> Dict[Tuple[str, str], List[BetOutcome]]:
+        # Flat (ref, market key) -> outcomes index, built on first lookup in one pass over all markets
+        index: Dict[Tuple[str, str], List[BetOutcome]] = {}
+        for key, market in self.markets.items():
+            for outcome in market.outcomes:
+                # Use 'description' if available (player/team), else fall back to 'name' (e.g. for spreads)
+                ref = outcome.description or outcome.name
+                if ref:
+                    index.setdefault((ref, key), []).append(outcome)
+        return index
+
+    @cached_property
+    def market_keys_by_ref(self) -> Dict[str, List[str]]:
+        # Each (ref, key) pair occurs once in outcome_index, so the key lists need no dedup
+        keys_by_ref: Dict[str, List[str]] = {}
+        for ref, key in self.outcome_index:
+            keys_by_ref.setdefault(ref, []).append(key)
+        return keys_by_ref
 
     def get_market(self, key: str) -> Optional[BetMarket]:
         return self.markets.get(key)
 
     def get_outcomes_for(self, entity: str) -> Dict[str, List[BetOutcome]]:
-        return self.description_index.get(entity, {})
+        outcome_index = self.outcome_index
+        return {key: outcome_index[(entity, key)] for key in self.market_keys_by_ref.get(entity, ())}
 
     def get_all_descriptions(self) -> List[str]:
-        return list(self.description_index.keys())
+        return list(self.market_keys_by_ref)
 
     def __repr__(self):
         return f"BetMarketGroup(markets={list(self.markets.keys())})"
 
 
+# Market kind by key for non-player markets; any "player_" market is a player market, anything else a match market
+MARKET_KIND = {
+    "team_totals": "team",
+    "alternate_team_totals": "team",
+    "spreads": "team",
+    "alternate_spreads": "team",
+}
+
+
 class BetEvent:
     def __init__(self, event_data: dict):
         self.event_id = event_data["id"]
@@ -70,20 +107,19 @@ class BetEvent:
         self._process_bookmakers()
 
     def _process_bookmakers(self):
+        market_groups = {
+            "player": self.player_markets,
+            "team": self.team_markets,
+            "match": self.match_markets,
+        }
+        from_dict = BetOutcome.from_dict
+
         # TODO: Supporting only one broker now
         for market_data in self.bookmakers[0]["markets"]:
             key = market_data["key"]
-            outcomes = [BetOutcome(**o) for o in market_data["outcomes"]]
-            market = BetMarket(key, outcomes)
-
-            if key.startswith("player_"):
-                self.player_markets.add_market(key, market)
-            elif key in {"alternate_team_totals", "team_totals"}:
-                self.team_markets.add_market(key, market)
-            elif key in {"spreads", "alternate_spreads"}:
-                self.team_markets.add_market(key, market)
-            else:
-                self.match_markets.add_market(key, market)
+            outcomes = [from_dict(o) for o in market_data["outcomes"]]
+            kind = "player" if key.startswith("player_") else MARKET_KIND.get(key, "match")
+            market_groups[kind].add_market(key, BetMarket(key, outcomes))
 
     def get_player_market(self, player_name: str) -> Dict[str, List[BetOutcome]]:
         return self.player_markets.get_outcomes_for(player_name)
@@ -145,6 +181,7 @@ class GameDetails:
 class NBATeamInfo:
 	nba_team_id: str
 	nba_team_name: str
+	nba_team_abbreviation: str = ""
 
 
 @dataclass(frozen=True)
@@ -168,41 +205,49 @@ class GlobalState:
 
 	def save_global_state(self, filepath: str) -> None:
 		with open(filepath, 'wb') as f:
-			pickle.dump(self, f)
+			# Protocol 5 (Python 3.8+) writes the numpy blocks behind player_stats DataFrames without extra copies
+			pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
 
 	def load_global_state(filepath: str) -> "GlobalState":
 		with open(filepath, 'rb') as f:
 			state = pickle.load(f)
 		return state
 
+	def invalidate_summary(self) -> None:
+		# Call after changing upcoming_games, upcoming_bets or player_stats
+		self.__dict__.pop("_summary_cache", None)
+
 	def summarize_state_for_data_agent(self):
+		# Cached as a plain attribute rather than a field, so it is never part of the graph state
+		summary = self.__dict__.get("_summary_cache")
+		if summary is None:
+			summary = self._summary_cache = self.build_summary_for_data_agent()
+		return summary
+
+	def build_summary_for_data_agent(self):
 		if not self.upcoming_games:
 			return "Don't have any information about upcoming games, teams, and players from NBA site."
 
 		if not self.upcoming_bets:
 			return "Don't have any information about upcoming bets for the NBA games."
 
-		summary = "Upcoming Games in NBA from the website:\n"
+		parts = ["Upcoming Games in NBA from the website:\n"]
 		for game_id, teams in self.upcoming_games.items():
-			summary += f"nba_game_id: {game_id}\n"
+			parts.append(f"nba_game_id: {game_id}\n")
 			for team_info, players in teams.items():
-				summary += f"  Team in NBA: {team_info.nba_team_name} (nba_team_id: {team_info.nba_team_id})\n"
-				if players:
-					for player in players:
-						summary += f"    - {player.nba_player_name} (nba_player_id: {player.nba_player_id})\n"
-		summary += "\n"
+				parts.append(f"  Team in NBA: {team_info.nba_team_name} (nba_team_id: {team_info.nba_team_id})\n")
+				parts.extend([f"    - {player.nba_player_name} (nba_player_id: {player.nba_player_id})\n" for player in players])
+		parts.append("\n")
 
 		if self.player_stats:
-			summary += "Player Stats available for player ids:\n"
-			for player_id, df in self.player_stats.items():
-				summary += f"  - {player_id}\n"
-			summary += "\n"
+			parts.append("Player Stats available for player ids:\n")
+			parts.extend([f"  - {player_id}\n" for player_id in self.player_stats])
+			parts.append("\n")
 
-		summary += "Bets for the upcoming NBA games from Odds API (betting odds, markets are also available for each player but just not displayed here):\n"
+		parts.append("Bets for the upcoming NBA games from Odds API (betting odds, markets are also available for each player but just not displayed here):\n")
 		for bet_event_id, bet_event in self.upcoming_bets.items():
-			summary += f"bet_event_id: {bet_event_id}; {bet_event.home_team} vs {bet_event.away_team}\n"
-			summary += f"  Available player names in player market bets:\n"
-			for player_name in bet_event.get_all_player_names():
-				summary += f"    - {player_name}\n"
+			parts.append(f"bet_event_id: {bet_event_id}; {bet_event.home_team} vs {bet_event.away_team}\n")
+			parts.append("  Available player names in player market bets:\n")
+			parts.extend([f"    - {player_name}\n" for player_name in bet_event.get_all_player_names()])
 
-		return summary
+		return "".join(parts)
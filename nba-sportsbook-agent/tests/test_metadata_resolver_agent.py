@@ -0,0 +1,71 @@
+import importlib.util
+import io
+import os
+import sys
+import types
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def install_openai_stub():
+    # The LLM is never called when a single game is resolved, so only the import has to succeed
+    if "openai" in sys.modules or importlib.util.find_spec("openai") is not None:
+        return
+    openai = types.ModuleType("openai")
+    openai.OpenAI = object
+    sys.modules["openai"] = openai
+
+
+class ResolveSingleGameTest(unittest.TestCase):
+    def setUp(self):
+        install_openai_stub()
+        from agents.metadata_resolver_agent import MetadataAgent
+        import state
+        self.state = state
+        self.agent = MetadataAgent(io.StringIO(), llm_client=object())
+
+    def resolve(self, user_query, home_team="Los Angeles Clippers", away_team="Oklahoma City Thunder"):
+        state = self.state
+        clippers = state.NBATeamInfo(nba_team_id="1", nba_team_name="Los Angeles Clippers", nba_team_abbreviation="LAC")
+        thunder = state.NBATeamInfo(nba_team_id="2", nba_team_name="Oklahoma City Thunder", nba_team_abbreviation="OKC")
+        event = types.SimpleNamespace(
+            home_team=home_team,
+            away_team=away_team,
+            get_all_player_names=lambda: ["James Harden", "Jalen Williams", "Jaylin Williams", "Shai Gilgeous-Alexander"],
+        )
+        global_state = state.GlobalState(
+            user_query=user_query,
+            upcoming_games={"g1": {
+                clippers: [state.NBAPlayerInfo("10", "James Harden")],
+                thunder: [
+                    state.NBAPlayerInfo("20", "Jalen Williams"),
+                    state.NBAPlayerInfo("21", "Jaylin Williams"),
+                    state.NBAPlayerInfo("22", "Shai Gilgeous-Alexander"),
+                ],
+            }},
+            upcoming_bets={"e1": event},
+        )
+        return self.agent.resolve_single_game(global_state)
+
+    def test_teams_matched_on_full_name_or_abbreviation(self):
+        game_details = self.resolve("Harden points?", home_team="LAC")
+        self.assertEqual(game_details.home_team_info.nba_team_id, "1")
+        self.assertEqual(game_details.away_team_info.nba_team_id, "2")
+
+    def test_teams_with_same_nickname_only_are_not_matched(self):
+        self.assertIsNone(self.resolve("Harden points?", home_team="Portland Clippers"))
+
+    def test_only_players_named_in_query_are_mapped(self):
+        game_details = self.resolve("Will Jalen Williams and Harden score 20?")
+        self.assertEqual(
+            sorted((p.nba_player_id, p.odds_player_name) for p in game_details.players_info),
+            [("10", "James Harden"), ("20", "Jalen Williams")],
+        )
+
+    def test_no_players_mapped_without_names_in_query(self):
+        self.assertEqual(self.resolve("Who wins tonight?").players_info, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
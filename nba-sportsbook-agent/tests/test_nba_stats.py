@@ -0,0 +1,98 @@
+from unittest import mock
+import importlib.util
+import os
+import sys
+import types
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+HAS_DEPS = all(importlib.util.find_spec(name) for name in ("pandas", "numpy", "requests"))
+
+
+def install_nba_api_stub():
+    # nba_api is only needed for its endpoint classes, which the tests replace anyway
+    if importlib.util.find_spec("nba_api") is not None:
+        return
+    modules = {name: types.ModuleType(name) for name in (
+        "nba_api", "nba_api.stats", "nba_api.stats.endpoints", "nba_api.stats.library",
+        "nba_api.stats.library.http", "nba_api.stats.static",
+    )}
+    endpoints = modules["nba_api.stats.endpoints"]
+    for name in ("boxscoresummaryv2", "boxscoretraditionalv2", "commonteamroster", "playergamelog", "scoreboardv2", "teamgamelog"):
+        setattr(endpoints, name, types.SimpleNamespace())
+    modules["nba_api.stats.library.http"].NBAStatsHTTP = types.SimpleNamespace(set_session=lambda session: None)
+    modules["nba_api.stats.static"].players = types.SimpleNamespace()
+    modules["nba_api.stats.static"].teams = types.SimpleNamespace()
+    sys.modules.update(modules)
+
+
+@unittest.skipUnless(HAS_DEPS, "pandas, numpy and requests are required")
+class GetUpcomingGamesTest(unittest.TestCase):
+    def setUp(self):
+        install_nba_api_stub()
+        import nba_stats
+        import pandas as pd
+        self.nba_stats = nba_stats
+        self.pd = pd
+
+    def fake_scoreboard(self, games_by_date):
+        pd = self.pd
+
+        class ScoreboardV2:
+            def __init__(self, game_date):
+                self.game_date = game_date
+
+            def get_data_frames(self):
+                games = games_by_date.get(self.game_date, [])
+                return [pd.DataFrame(games, columns=["GAME_ID", "GAME_DATE_EST"])]
+
+        return ScoreboardV2
+
+    def get_upcoming_games(self, games_by_date, days_ahead):
+        scoreboard = types.SimpleNamespace(ScoreboardV2=self.fake_scoreboard(games_by_date))
+        with mock.patch.object(self.nba_stats, "scoreboardv2", scoreboard):
+            return self.nba_stats.NBAStatsAPI().get_upcoming_games(days_ahead=days_ahead)
+
+    def test_games_from_all_dates_sorted_by_date(self):
+        today = self.nba_stats.datetime.today()
+        dates = [(today + self.nba_stats.timedelta(days=i)).strftime('%m/%d/%Y') for i in range(2)]
+        games_df = self.get_upcoming_games({
+            dates[1]: [("002", "2025-01-02T00:00:00")],
+            dates[0]: [("001", "2025-01-01T00:00:00")],
+        }, days_ahead=1)
+        self.assertEqual(games_df["GAME_ID"].tolist(), ["001", "002"])
+
+    def test_no_games(self):
+        with self.assertLogs(self.nba_stats.logger, level="INFO") as logs:
+            games_df = self.get_upcoming_games({}, days_ahead=1)
+        self.assertIsInstance(games_df, self.pd.DataFrame)
+        self.assertTrue(games_df.empty)
+        self.assertEqual(games_df.columns.tolist(), ["GAME_ID", "GAME_DATE_EST"])
+        self.assertTrue(any("No upcoming games found" in message for message in logs.output))
+
+
+
+@unittest.skipUnless(HAS_DEPS, "pandas, numpy and requests are required")
+class GetPlayerStatsBatchTest(unittest.TestCase):
+    def setUp(self):
+        install_nba_api_stub()
+        import nba_stats
+        import pandas as pd
+        self.nba_stats = nba_stats
+        self.pd = pd
+
+    def test_failed_player_is_omitted(self):
+        def get_player_stats(player_id):
+            if player_id == 2:
+                raise RuntimeError("request failed")
+            return self.pd.DataFrame({"PLAYER_ID": [player_id]})
+
+        client = self.nba_stats.NBAStatsAPI()
+        with mock.patch.object(client, "get_player_stats", side_effect=get_player_stats):
+            stats_by_player_id = client.get_player_stats_batch([1, 2, 3])
+        self.assertEqual(sorted(stats_by_player_id), [1, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
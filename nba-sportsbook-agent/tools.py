@@ -1,13 +1,18 @@
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from nba_stats import NBAStatsAPI
 from odds import OddsAPIClient
-from typing import Callable, Optional, Dict, Any, List
-from utils import logger
+from typing import Callable, Optional, Dict, Any, List, Set
+from utils import dumps_json, loads_json, logger
 import json
+import functools
+import hashlib
+import inspect
 import os
+import sqlite3
 import state
+import threading
 import time
 
 load_dotenv()
@@ -16,6 +21,66 @@ load_dotenv()
 nba_stats_client = NBAStatsAPI()
 odds_api_client = OddsAPIClient()
 BETS_CACHE_DIR = "cache/bets"
+# Reserved key for the day's event list in the bets cache; event ids never collide with it
+EVENTS_LIST_KEY = "__events_list__"
+# Games loaded within this many seconds are served from memory
+LOADER_CACHE_TTL_SECONDS = 300
+
+
+# Caches of every ttl_cache-decorated function, so clear_caches can reset them all
+_ttl_caches: List[Dict] = []
+
+
+def ttl_cache(ttl_seconds: float):
+    # Memoizes a loader on its arguments for ttl_seconds. Cached results are shared, so callers must not mutate them.
+    def decorator(func):
+        cache = {}
+        lock = threading.Lock()
+        signature = inspect.signature(func)
+        _ttl_caches.append(cache)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # Bound arguments with defaults applied, so f(1), f(days_ahead=1) and f() share one entry
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = tuple(bound.arguments.items())
+            with lock:
+                entry = cache.get(key)
+            if entry is not None and time.monotonic() - entry[0] < ttl_seconds:
+                logger.debug(f"Using cached result of {func.__name__} for {key}.")
+                return entry[1]
+
+            result = func(*args, **kwargs)
+            with lock:
+                cache[key] = (time.monotonic(), result)
+            return result
+
+        return wrapper
+    return decorator
+
+
+def clear_caches() -> None:
+    # Drops every memoized result, e.g. so tests start from a cold cache
+    for cache in _ttl_caches:
+        cache.clear()
+
+
+def slim_event_data(event_data: Dict[str, Any], markets: Set[str]) -> Dict[str, Any]:
+    # Keep only what BetEvent reads: the event fields and the requested markets of the first bookmaker.
+    # The full payload stays in the bets cache; the BetEvent (which is pickled with the state) holds the slim copy.
+    bookmakers = event_data["bookmakers"][:1]
+    return {
+        "id": event_data["id"],
+        "home_team": event_data["home_team"],
+        "away_team": event_data["away_team"],
+        "bookmakers": [
+            {
+                "key": bookmaker.get("key"),
+                "markets": [market for market in bookmaker["markets"] if market["key"] in markets],
+            } for bookmaker in bookmakers
+        ],
+    }
 
 
 
@@ -55,24 +120,69 @@ class Tool:
     {self.tool_outputs}
 """
 
+class BetsCache:
+    """Odds API payloads for one day, stored as compact JSON (via orjson when installed) in a single SQLite file keyed by event id."""
+
+    def __init__(self, path: str):
+        cache_dir = os.path.dirname(path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self.path = path
+        # Autocommit mode; WAL keeps readers and the occasional writer from blocking each other
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS events (id TEXT PRIMARY KEY, payload BLOB NOT NULL)")
+
+    def get(self, key: str) -> Any:
+        row = self.conn.execute("SELECT payload FROM events WHERE id = ?", (key,)).fetchone()
+        return loads_json(row[0]) if row else None
+
+    def set(self, key: str, data: Any) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO events (id, payload) VALUES (?, ?)", (key, dumps_json(data)))
+
+    def set_many(self, items: Dict[str, Any]) -> None:
+        # One transaction, so a batch of payloads costs a single commit
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.executemany("INSERT OR REPLACE INTO events (id, payload) VALUES (?, ?)", [(key, dumps_json(data)) for key, data in items.items()])
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
 def load_upcoming_nba_games_and_bets(days_ahead: int = 1):
     logger.info(f"Loading upcoming NBA games and bets for {days_ahead} days ahead.")
-    upcoming_nba_games = load_upcoming_nba_games(days_ahead)
-    upcoming_nba_bets = load_upcoming_nba_bets(days_ahead)
+    # stats.nba.com and the Odds API are independent, so both sides load concurrently
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        games_future = executor.submit(load_upcoming_nba_games, days_ahead)
+        bets_future = executor.submit(load_upcoming_nba_bets, days_ahead)
+        upcoming_nba_games = games_future.result()
+        upcoming_nba_bets = bets_future.result()
     # Consider adding more robust error checking here if either call fails partially.
     return upcoming_nba_games, upcoming_nba_bets
 
+@ttl_cache(LOADER_CACHE_TTL_SECONDS)
 def load_upcoming_nba_games(days_ahead: int = 1):
     logger.info(f"Loading upcoming NBA games for {days_ahead} days ahead using NBAStatsAPI.")
-    upcoming_games_map = defaultdict(dict)
+    upcoming_games_map: Dict[str, Dict[state.NBATeamInfo, List[state.NBAPlayerInfo]]] = {}
 
     # Get static team info (used for mapping IDs to names)
     teams_df = nba_stats_client.get_teams()
     if teams_df.empty:
         logger.error("Failed to load NBA teams static data. Cannot proceed with loading games.")
-        raise
-    
-    # players_df = nba_stats_client.get_all_players() # This was in original, but not used. Removed for now.
+        raise RuntimeError("Failed to load NBA teams static data.")
 
     # Get upcoming game data
     games_df = nba_stats_client.get_upcoming_games(days_ahead=days_ahead)
@@ -80,143 +190,162 @@ def load_upcoming_nba_games(days_ahead: int = 1):
         logger.info("No upcoming NBA games found by NBAStatsAPI.")
         return {}
 
-    for _, row in games_df.iterrows():
-        game_id = str(row["GAME_ID"])
-        home_team_id = row["HOME_TEAM_ID"]
-        away_team_id = row["VISITOR_TEAM_ID"]
+    # One dict lookup per team instead of a boolean mask over teams_df
+    team_name_by_id: Dict[int, str] = dict(zip(teams_df["id"].tolist(), teams_df["full_name"].tolist()))
+    team_abbreviation_by_id: Dict[int, str] = dict(zip(teams_df["id"].tolist(), teams_df["abbreviation"].tolist()))
+
+    # Only three columns are read, so iterate plain tuples instead of building a Series per row
+    games = list(games_df[["GAME_ID", "HOME_TEAM_ID", "VISITOR_TEAM_ID"]].itertuples(index=False, name=None))
+
+    # Fetch each team's roster once, even when the team plays on several of the days
+    team_ids = [team_id for _, home_team_id, away_team_id in games for team_id in (home_team_id, away_team_id) if team_id in team_name_by_id]
+    roster_by_team = nba_stats_client.get_team_players_batch(team_ids)
+
+    for game_id, home_team_id, away_team_id in games:
+        game_id = str(game_id)
 
         for team_id_int in [home_team_id, away_team_id]:
             team_id_str = str(team_id_int)
-            team_row_df = teams_df[teams_df["id"] == team_id_int] # Match by integer ID from games_df
-            
-            if team_row_df.empty:
-                logger.error(f"Team ID {team_id_int} not found in static teams data for game {game_id}. Skipping team.")
-                raise
-            team_name = team_row_df.iloc[0]["full_name"]
+            team_name = team_name_by_id.get(team_id_int) # Match by integer ID from games_df
+            if team_name is None:
+                logger.error("Team ID %s not found in static teams data for game %s. Skipping team.", team_id_int, game_id)
+                continue
 
-            team_info = state.NBATeamInfo(nba_team_id=team_id_str, nba_team_name=team_name)
+            team_info = state.NBATeamInfo(nba_team_id=team_id_str, nba_team_name=team_name, nba_team_abbreviation=team_abbreviation_by_id[team_id_int])
 
             # Get players for team
-            team_roster_df = nba_stats_client.get_team_players(team_id=team_id_int) # Use integer team_id
+            team_roster_df = roster_by_team[team_id_int]
             if team_roster_df.empty:
-                logger.error(f"Failed to get player roster for team_id {team_id_int} in game {game_id}. Skipping players for this team.")
+                logger.error("Failed to get player roster for team_id %s in game %s. Skipping players for this team.", team_id_int, game_id)
                 # Still add team info, but with empty player list
-                upcoming_games_map[game_id][team_info] = []
-                raise
+                upcoming_games_map.setdefault(game_id, {})[team_info] = []
+                continue
 
-            player_infos = []
-            for _, player_row in team_roster_df.iterrows():
-                player_infos.append(
-                    state.NBAPlayerInfo(
-                        nba_player_id=str(player_row["PLAYER_ID"]),
-                        nba_player_name=player_row["PLAYER"] # Assuming 'PLAYER' is the name column
-                    )
+            player_infos = [
+                state.NBAPlayerInfo(
+                    nba_player_id=str(player_id),
+                    nba_player_name=player_name # Assuming 'PLAYER' is the name column
                 )
-            upcoming_games_map[game_id][team_info] = player_infos
+                for player_id, player_name in zip(team_roster_df["PLAYER_ID"].tolist(), team_roster_df["PLAYER"].tolist())
+            ]
+            upcoming_games_map.setdefault(game_id, {})[team_info] = player_infos
     
     logger.info(f"Successfully processed {len(upcoming_games_map)} upcoming NBA games.")
-    return dict(upcoming_games_map)
+    return upcoming_games_map
 
 def load_players_stats(player_ids: List[str]):
     logger.info(f"Loading player stats for player IDs: {player_ids} using NBAStatsAPI.")
     player_stats_dict = {}
 
+    # Validate every ID before any request is made, so bad input fails fast and is reported all at once
+    player_ids_int = {}
+    invalid_player_ids = []
     for player_id_str in player_ids:
         try:
-            player_id_int = int(player_id_str) # NBAStatsAPI expects int for player_id
-            stats_df = nba_stats_client.get_player_stats(player_id_int)
-            if not stats_df.empty:
-                player_stats_dict[player_id_str] = stats_df
-                logger.debug(f"Successfully fetched stats for player ID {player_id_str}.")
-            else:
-                logger.error(f"No stats returned for player ID {player_id_str}.")
-                raise
-            # Respect NBA API rate limits - keep the sleep
-            time.sleep(1.1) 
-        except ValueError:
-            logger.error(f"Invalid player ID format: '{player_id_str}'. Must be convertible to int.")
-            raise
+            player_ids_int[player_id_str] = int(player_id_str) # NBAStatsAPI expects int for player_id
+        except (TypeError, ValueError):
+            invalid_player_ids.append(player_id_str)
+    if invalid_player_ids:
+        logger.error(f"Invalid player ID format: {invalid_player_ids}. Must be convertible to int.")
+        raise ValueError(f"Invalid player IDs: {invalid_player_ids}")
+
+    # Players are fetched concurrently; NBAStatsAPI rate limits the requests, so no sleep is needed here
+    stats_by_player_id = nba_stats_client.get_player_stats_batch(player_ids_int.values())
+    for player_id_str, player_id_int in player_ids_int.items():
+        stats_df = stats_by_player_id.get(player_id_int)
+        if stats_df is None:
+            logger.error("Failed to fetch stats for player ID %s. Skipping player.", player_id_str)
+        elif not stats_df.empty:
+            player_stats_dict[player_id_str] = stats_df
+            logger.debug("Successfully fetched stats for player ID %s.", player_id_str)
+        else:
+            logger.error("No stats returned for player ID %s. Skipping player.", player_id_str)
 
     logger.info(f"Finished fetching stats for {len(player_stats_dict)} out of {len(player_ids)} requested players.")
     return player_stats_dict
 
-def load_upcoming_nba_bets(days_ahead: int = 1, use_cache: bool = True):
+def load_upcoming_nba_bets(days_ahead: int = 1, use_cache: bool = True, markets: Optional[List[str]] = None):
     logger.info(f"Loading upcoming NBA bets for {days_ahead} days ahead using OddsAPIClient. Cache enabled: {use_cache}.")
-    os.makedirs(BETS_CACHE_DIR, exist_ok=True)
-    
-    current_processing_date_str = datetime.now().strftime("%Y-%m-%d")
-    date_dir = os.path.join(BETS_CACHE_DIR, current_processing_date_str)
-    os.makedirs(date_dir, exist_ok=True)
+    # Markets are filtered by the Odds API, and again by slim_event_data for cached payloads
+    if markets is None:
+        markets = odds_api_client.DEFAULT_MARKETS
+    market_set = set(markets)
 
-    events_list_path = os.path.join(date_dir, "events_list.json")
-    
-    events_data = []
-    if use_cache and os.path.exists(events_list_path):
-        logger.info(f"Loading cached event list from {events_list_path}")
-        try:
-            with open(events_list_path, "r") as f:
-                events_data = json.load(f)
-        except json.JSONDecodeError as e:
-            logger.error(f"Error decoding cached event list {events_list_path}: {e}. Fetching live data.")
-            raise
+    # The cache is keyed by the processing date, the window length and the market set, so an event list is never
+    # reused on a later day (its first games would already be played) or for a different days_ahead, and payloads
+    # fetched for one set of markets are never served for another
+    current_processing_date_str = datetime.now().strftime("%Y-%m-%d")
+    markets_hash = hashlib.sha1(",".join(sorted(market_set)).encode()).hexdigest()[:8]
+    cache_path = os.path.join(BETS_CACHE_DIR, f"{current_processing_date_str}_{days_ahead}_{markets_hash}.sqlite")
 
-    if not events_data: # Fetch if cache miss, empty, or failed to load
-        logger.info(f"Fetching live event list (days_ahead={days_ahead}).")
-        events_data = odds_api_client.get_sports_events(days_ahead=days_ahead) 
-        if events_data:
+    with BetsCache(cache_path) as bets_cache:
+        events_data = []
+        if use_cache:
             try:
-                with open(events_list_path, "w") as f:
-                    json.dump(events_data, f, indent=2)
-                logger.info(f"Saved event list to {events_list_path}")
-            except IOError as e:
-                logger.error(f"Error saving event list to {events_list_path}: {e}")
-                raise
-        else:
-            logger.debug("No events data fetched from API. Cannot proceed with loading bets.")
-            return {}
-
+                events_data = bets_cache.get(EVENTS_LIST_KEY) or []
+                if events_data:
+                    logger.info(f"Loaded cached event list from {cache_path}")
+            except json.JSONDecodeError as e:
+                logger.error(f"Error decoding cached event list in {cache_path}: {e}. Fetching live data.")
+                events_data = []
 
-    event_map = {}
-    for event_meta in events_data:
-        event_id = event_meta.get("id")
-        if not event_id:
-            logger.error(f"Skipping event with missing ID in events_data: {event_meta}")
-            raise
-            
-        # Individual event cache is within the date_dir of the *processing date*
-        event_path = os.path.join(date_dir, f"{event_id}.json")
-        detailed_event_data = None
+        if not events_data: # Fetch if cache miss, empty, or failed to load
+            logger.info(f"Fetching live event list (days_ahead={days_ahead}).")
+            events_data = odds_api_client.get_sports_events(days_ahead=days_ahead) 
+            if events_data:
+                bets_cache.set(EVENTS_LIST_KEY, events_data)
+                logger.info(f"Saved event list to {cache_path}")
+            else:
+                logger.debug("No events data fetched from API. Cannot proceed with loading bets.")
+                return {}
 
-        if use_cache and os.path.exists(event_path):
-            logger.info(f"Loading cached event data for {event_id} from {event_path}")
-            try:
-                with open(event_path, "r") as f:
-                    detailed_event_data = json.load(f)
-            except json.JSONDecodeError as e:
-                logger.error(f"Error decoding cached event data {event_path} for event {event_id}: {e}. Fetching live data.")
-                raise
+        # First pass: read cached payloads and collect the events that still need to be fetched.
+        # Log calls in the per-event loops use %-style arguments, so messages are only formatted when emitted.
+        detailed_events_data = {}
+        missing_event_ids = []
+        for event_meta in events_data:
+            event_id = event_meta.get("id")
+            if not event_id:
+                logger.error("Skipping event with missing ID in events_data: %s", event_meta)
+                continue
 
-        if not detailed_event_data: # Fetch if cache miss, empty, or failed to load
-            logger.info(f"Fetching live detailed odds for event {event_id}")
-            detailed_event_data = odds_api_client.get_event_odds(event_id=event_id, sport="basketball_nba")
-            if detailed_event_data: # Only save if data was successfully fetched
+            detailed_event_data = None
+            if use_cache:
                 try:
-                    with open(event_path, "w") as f:
-                        json.dump(detailed_event_data, f, indent=2)
-                    logger.info(f"Cached detailed event to {event_path}")
-                except IOError as e:
-                    logger.error(f"Error saving detailed event {event_id} to {event_path}: {e}")
-                    raise
-            else:
-                logger.warning(f"No detailed odds data fetched for event {event_id}. Skipping.")
+                    detailed_event_data = bets_cache.get(event_id)
+                    if detailed_event_data:
+                        logger.info("Loaded cached event data for %s from %s", event_id, cache_path)
+                except json.JSONDecodeError as e:
+                    logger.error("Error decoding cached event data in %s for event %s: %s. Fetching live data.", cache_path, event_id, e)
+
+            detailed_events_data[event_id] = detailed_event_data
+            if not detailed_event_data: # Fetch if cache miss or empty
+                missing_event_ids.append(event_id)
+
+        # Cache misses are fetched concurrently, then cached from this thread in a single transaction
+        if missing_event_ids:
+            logger.info(f"Fetching live detailed odds for events {missing_event_ids}")
+            fetched_events_data = odds_api_client.get_events_odds(missing_event_ids, sport="basketball_nba", markets=markets)
+            fetched_events_data = {event_id: data for event_id, data in fetched_events_data.items() if data} # Only save successfully fetched data
+            bets_cache.set_many(fetched_events_data)
+            logger.info(f"Cached {len(fetched_events_data)} detailed events to {cache_path}")
+
+            for event_id in missing_event_ids:
+                detailed_event_data = fetched_events_data.get(event_id)
+                if not detailed_event_data:
+                    logger.warning("No detailed odds data fetched for event %s. Skipping.", event_id)
+                    del detailed_events_data[event_id]
+                    continue
+                detailed_events_data[event_id] = detailed_event_data
+
+        event_map = {}
+        for event_id, detailed_event_data in detailed_events_data.items():
+            try:
+                event_obj = state.BetEvent(slim_event_data(detailed_event_data, market_set))
+                event_map[event_id] = event_obj
+            except Exception as e:
+                logger.error("Error parsing or validating event data for %s: %s. Data: %s", event_id, e, detailed_event_data, exc_info=True)
                 raise
-        
-        try:
-            event_obj = state.BetEvent(detailed_event_data)
-            event_map[event_id] = event_obj
-        except Exception as e:
-            logger.error(f"Error parsing or validating event data for {event_id}: {e}. Data: {detailed_event_data}", exc_info=True)
-            raise
 
     logger.info(f"Finished loading upcoming bets. {len(event_map)} events processed.")
     return event_map
@@ -1,5 +1,12 @@
-from typing import Optional
+from typing import Any, Optional, Union
+import json
 import logging
+import re
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the standard library
+    orjson = None
 
 logging.basicConfig(
     level=logging.INFO,  # or DEBUG
@@ -7,6 +14,11 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+_json_decoder = json.JSONDecoder(strict=False)
+
+# Surrounding whitespace, backtick fences and a leading "json" tag around an LLM JSON payload
+_FENCE_RE = re.compile(r"^\s*`*\s*(?:json)?\s*(.*?)\s*`*\s*$", re.DOTALL)
+
 def read_file(path: str) -> Optional[str]:
     try:
         with open(path, 'r', encoding='utf-8') as file:
@@ -20,14 +32,87 @@ def read_file(path: str) -> Optional[str]:
         return None
 
 
-def write_to_file(path: str, content: str) -> None:
-    try:
-        with open(path, 'a', encoding='utf-8') as file:
-            file.write(content)
-        logger.info(f"Content written to file: {path}")
-    except FileNotFoundError:
-        logger.error(f"File not found: {path}")
-        raise
-    except Exception as e:
-        logger.error(f"Error writing to file '{path}': {e}")
-        raise
+class AppendWriter:
+    """Keeps one buffered append handle open, so many small writes share one open() and are flushed in blocks."""
+
+    def __init__(self, path: str, buffering: int = 1 << 16):
+        self.path = path
+        self.file = open(path, 'a', encoding='utf-8', buffering=buffering)
+
+    def write(self, content: str) -> None:
+        self.file.write(content)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def dumps_json(obj: Any) -> str:
+    # Compact JSON, using orjson when it is installed
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+def strip_code_fence(text: str) -> str:
+    return _FENCE_RE.match(text).group(1)
+
+
+def loads_json(text: Union[str, bytes]) -> Any:
+    # orjson is the fast path; it rejects raw control characters inside strings, which LLMs
+    # sometimes emit, so those responses are re-parsed with the lenient stdlib decoder.
+    # Raw response bytes are accepted as well, which lets orjson skip building an intermediate str.
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+    if isinstance(text, bytes):
+        text = text.decode("utf-8")
+    return _json_decoder.decode(text)
+
+
+def extract_json(text: str) -> Any:
+    # Parse the first JSON object in an LLM response, ignoring code fences or any text around it
+    start = text.find("{")
+    if start == -1:
+        raise json.JSONDecodeError("No JSON object found", text, 0)
+    parsed, _ = _json_decoder.raw_decode(text, start)
+    return parsed
+
+
+class JsonObjectScanner:
+    """Tracks streamed text and reports where the first top-level JSON object closes."""
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, chunk: str) -> int:
+        # Returns the index just past the closing brace within chunk, or -1 if the object is still open
+        for i, char in enumerate(chunk):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = self.depth > 0
+            elif char == "{":
+                self.depth += 1
+            elif char == "}" and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    return i + 1
+        return -1